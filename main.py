@@ -1,7 +1,6 @@
 import os
 import sys
 import json
-from datetime import datetime
 import google.generativeai as genai
 from tqdm import tqdm
 import subprocess
@@ -11,6 +10,9 @@ import subprocess
 # If 'src' is in the same directory, this might not be needed when running as a module.
 # However, to be safe, we will retain it.
 sys.path.append(os.path.dirname(__file__))
+# Modules inside src/ import their siblings directly (e.g. `from graph_schema import ...`),
+# so src/ itself also needs to be importable.
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 # --- End Path Correction ---
 
 # config.py is not a file we've created together. 
@@ -28,6 +30,12 @@ load_dotenv()
 from src.graph_schema import BASE_NODE_LABELS, RELATIONSHIP_TYPES
 # --- MODIFICATION END ---
 # ==============================================================================
+from extraction_engine import run_in_order
+from llm_client import generate_content, get_response_cache, is_graph_response, is_packed_graph_response, discard_cached_response, estimate_tokens, usage_token_counts
+from results_store import ResultsStore, compact
+from schema_registry import is_on_schema
+from chunker import BookChunks
+from schema_selector import SchemaSelector, load_schema_selector
 
 
 # --- Constants ---
@@ -37,25 +45,28 @@ DATA_DIR = "data"
 BOOK_PATH = os.path.join(DATA_DIR, "book.txt")
 GRAPH_OUTPUT_PATH = os.path.join(DATA_DIR, "extracted_graph.json")
 STATS_PATH = os.path.join(DATA_DIR, "progress_stats.json")
+# Append-only, per-chunk log of extraction results. GRAPH_OUTPUT_PATH is compacted from it on demand.
+RESULTS_LOG_PATH = os.path.join(DATA_DIR, "extraction_results.jsonl")
 CHUNK_SIZE = 10000
 CHUNK_OVERLAP = 500
+# Number of chunk requests kept in flight at once during extraction.
+MAX_IN_FLIGHT_REQUESTS = int(os.getenv("MAX_IN_FLIGHT_REQUESTS", "8"))
+# Send each chunk only the relationship types cued by its text (plus core types) instead of the full schema.
+PRUNE_SCHEMA_PROMPT = os.getenv("PRUNE_SCHEMA_PROMPT", "1") != "0"
+# Number of consecutive chunks packed into a single extraction request (1 disables packing).
+CHUNKS_PER_REQUEST = int(os.getenv("CHUNKS_PER_REQUEST", "1"))
 
 # --- Core Extraction Logic ---
 
-def read_book_chunks(file_path: str, chunk_size: int, overlap: int) -> list[str]:
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
-    except FileNotFoundError:
+def read_book_chunks(file_path: str, chunk_size: int, overlap: int) -> BookChunks | list:
+    """
+    Returns a lazy, indexable view of the book's chunks. Chunk boundaries snap to paragraph and
+    sentence breaks, and their byte offsets are cached next to the book so later runs skip re-chunking.
+    """
+    if not os.path.exists(file_path):
         print(f"Error: The file {file_path} was not found.")
         return []
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += chunk_size - overlap
-    return chunks
+    return BookChunks(file_path, chunk_size, overlap)
 
 def load_data(file_path: str, default_value):
     if not os.path.exists(file_path):
@@ -73,12 +84,13 @@ def save_data(data: any, file_path: str):
     except IOError as e:
         print(f"Error saving data to {file_path}: {e}")
 
-def generate_system_prompt() -> str:
+def generate_system_prompt(relationship_types: list[str] | None = None) -> str:
     # ==============================================================================
     # --- MODIFICATION START ---
     # We now build the prompt strings from our new lists in graph_schema.py
+    # A per-chunk subset of relationship types may be passed in; by default the full list is used.
     node_labels_str = ", ".join([f'"{label}"' for label in BASE_NODE_LABELS])
-    relationship_types_str = ",\n".join([f'    "{rel}"' for rel in RELATIONSHIP_TYPES])
+    relationship_types_str = ",\n".join([f'    "{rel}"' for rel in (relationship_types or RELATIONSHIP_TYPES)])
     
     # The prompt is updated to reflect the new schema source and instructions.
     return f"""
@@ -118,41 +130,173 @@ You are a meticulous historian and data analyst. Your task is to extract structu
     # --- MODIFICATION END ---
     # ==============================================================================
 
-def process_chunks(model, chunks_to_process: list[tuple[int, str]], system_prompt: str) -> tuple[list, list[int], list[int], int, int]:
+def extract_chunk(model, index: int, chunk_text: str, system_prompt: str) -> tuple[list | None, int, int]:
+    """
+    Runs the extraction for a single chunk.
+    Returns (relationships, input_tokens, output_tokens); relationships is None if the chunk failed.
+    """
+    input_token_count = 0
+    output_token_count = 0
+    try:
+        full_prompt = f"{system_prompt}\n\n**متن ورودی برای تحلیل:**\n\n---\n{chunk_text}\n---"
+        
+        # Throttled to the shared RPM/TPM budget; quota errors are retried with backoff.
+        response = generate_content(model, full_prompt, validate=is_graph_response)
+        
+        # Token accounting comes from the response itself, so no separate count_tokens round trip is needed.
+        input_token_count, output_token_count = usage_token_counts(response)
+        
+        response_text = response.text.strip().replace("```json", "").replace("```", "")
+        data = json.loads(response_text)
+        
+        if "graph" in data and isinstance(data["graph"], list):
+            chunk_relationships = data["graph"]
+            off_schema = sum(1 for rel in chunk_relationships if not is_on_schema(rel))
+            tqdm.write(f"Chunk {index}: Extracted {len(chunk_relationships)} relationships ({off_schema} off-schema). Input Tokens: {input_token_count}")
+            return chunk_relationships, input_token_count, output_token_count
+        tqdm.write(f"Warning: Chunk {index}: Received malformed data from API.")
+    except (json.JSONDecodeError, Exception) as e:
+        tqdm.write(f"Warning: Chunk {index}: An error occurred. Details: {e}")
+    return None, input_token_count, output_token_count
+
+PACKED_EXTRACTION_INSTRUCTIONS = """
+# Multiple Segments:
+The input below contains several independent text segments. Each one starts with a line of the form `=== SEGMENT <id> ===`.
+- Extract relationships from every segment separately, following all instructions above.
+- Every relationship object MUST have one additional key, "segment", holding the integer id of the segment it came from.
+- In addition to "graph", the JSON object MUST have a key "segments" listing the ids of ALL segments you processed, including segments without relationships.
+"""
+
+def select_prompt(chunk_texts: list[str], label: str, system_prompt: str, selector: SchemaSelector | None) -> str:
+    """Returns the system prompt for one request, pruned to the relationship types cued by its chunk(s)."""
+    if selector is None or not selector.enabled:
+        return system_prompt
+    cued_types = set()
+    for text in chunk_texts:
+        cued_types.update(selector.select(text))
+    selected_types = [rel for rel in RELATIONSHIP_TYPES if rel in cued_types]
+    saved_tokens = selector.record(selected_types)
+    tqdm.write(f"{label}: Prompt offers {len(selected_types)}/{len(RELATIONSHIP_TYPES)} relationship types (~{saved_tokens:,} input tokens saved).")
+    return generate_system_prompt(selected_types)
+
+def extract_packed_chunks(model, pack: list[tuple[int, str]], system_prompt: str) -> tuple[dict[int, tuple[list, int, int]] | None, int, int]:
+    """
+    Extracts several chunks with a single request and splits the returned graph back into
+    per-chunk results. Returns (results, input_tokens, output_tokens); results is None if
+    the packed response cannot be demultiplexed reliably, but the request's usage is still
+    returned, since it was billed.
+    """
+    label = f"Chunks {pack[0][0]}-{pack[-1][0]}"
+    input_token_count = 0
+    output_token_count = 0
+    try:
+        segments = "\n\n".join(f"=== SEGMENT {index} ===\n{chunk_text}" for index, chunk_text in pack)
+        full_prompt = f"{system_prompt}\n{PACKED_EXTRACTION_INSTRUCTIONS}\n**متن ورودی برای تحلیل:**\n\n---\n{segments}\n---"
+        response = generate_content(model, full_prompt, validate=is_packed_graph_response)
+        input_token_count, output_token_count = usage_token_counts(response)
+        data = json.loads(response.text.strip().replace("```json", "").replace("```", ""))
+    except Exception as e:
+        tqdm.write(f"Warning: {label}: Packed request failed. Details: {e}")
+        return None, input_token_count, output_token_count
+
+    expected = {index for index, _ in pack}
+    if not isinstance(data, dict) or not isinstance(data.get("graph"), list) or not isinstance(data.get("segments"), list):
+        tqdm.write(f"Warning: {label}: Packed response is malformed.")
+        return None, input_token_count, output_token_count
+    try:
+        reported = {int(segment) for segment in data["segments"]}
+        per_chunk = {index: [] for index in expected}
+        for rel in data["graph"]:
+            segment = int(rel.pop("segment"))
+            if segment not in per_chunk:
+                raise ValueError(f"unknown segment {segment}")
+            per_chunk[segment].append(rel)
+    except (TypeError, ValueError, KeyError, AttributeError) as e:
+        tqdm.write(f"Warning: {label}: Could not map packed output back to chunks ({e}).")
+        # Well-formed JSON, so it was cached; a retry must ask the model again instead of replaying it.
+        discard_cached_response(model, full_prompt)
+        return None, input_token_count, output_token_count
+    if reported != expected:
+        tqdm.write(f"Warning: {label}: Packed response covered segments {sorted(reported)} instead of {sorted(expected)}.")
+        discard_cached_response(model, full_prompt)
+        return None, input_token_count, output_token_count
+
+    # Usage is reported per request; attribute it to chunks in proportion to their length.
+    total_chars = sum(len(chunk_text) for _, chunk_text in pack) or 1
+    results = {}
+    for index, chunk_text in pack:
+        share = len(chunk_text) / total_chars
+        results[index] = (per_chunk[index], round(input_token_count * share), round(output_token_count * share))
+        off_schema = sum(1 for rel in per_chunk[index] if not is_on_schema(rel))
+        tqdm.write(f"Chunk {index}: Extracted {len(per_chunk[index])} relationships ({off_schema} off-schema, packed request).")
+    return results, input_token_count, output_token_count
+
+def process_chunks(model, chunks_to_process: list[tuple[int, str]], system_prompt: str, store: ResultsStore | None = None, selector: SchemaSelector | None = None, max_in_flight: int = MAX_IN_FLIGHT_REQUESTS, chunks_per_request: int = CHUNKS_PER_REQUEST) -> list:
+    """
+    Extracts relationships from the given chunks with up to `max_in_flight` concurrent requests
+    and returns the newly extracted relationships, in chunk order regardless of the order in
+    which requests complete.
+    If a store is given, each chunk's result is checkpointed to it as soon as that chunk finishes.
+    If a selector is given, each request gets its own system prompt with only the relevant relationship types.
+    With `chunks_per_request` > 1, consecutive chunks share one request (and one copy of the schema prompt);
+    a pack whose response cannot be split back into chunks is retried one chunk at a time.
+    """
     newly_extracted_relationships = []
-    successfully_processed_indices = []
-    failed_indices = []
-    total_input_tokens = 0
-    total_output_tokens = 0
-    for index, chunk_text in tqdm(chunks_to_process, desc="Extracting from chunks"):
-        try:
-            full_prompt = f"{system_prompt}\n\n**متن ورودی برای تحلیل:**\n\n---\n{chunk_text}\n---"
-            
-            input_token_count = model.count_tokens(full_prompt).total_tokens
-            total_input_tokens += input_token_count
-            
-            response = model.generate_content(full_prompt)
-            
-            usage_metadata = response.usage_metadata
-            if usage_metadata:
-                total_output_tokens += usage_metadata.candidates_token_count
-            
-            response_text = response.text.strip().replace("```json", "").replace("```", "")
-            data = json.loads(response_text)
-            
-            if "graph" in data and isinstance(data["graph"], list):
-                chunk_relationships = data["graph"]
+    chunks_per_request = max(1, chunks_per_request)
+    packs = [chunks_to_process[i:i + chunks_per_request] for i in range(0, len(chunks_to_process), chunks_per_request)]
+
+    def record(index, result):
+        if store is not None:
+            new_unique = store.append_chunk(index, *result)
+            chunk_relationships = result[0]
+            if chunk_relationships and new_unique < len(chunk_relationships):
+                tqdm.write(f"Chunk {index}: {len(chunk_relationships) - new_unique} relationships duplicate earlier extractions and were merged.")
+
+    def worker(pack):
+        results = None
+        if len(pack) > 1:
+            prompt = select_prompt([text for _, text in pack], f"Chunks {pack[0][0]}-{pack[-1][0]}", system_prompt, selector)
+            results, packed_input_tokens, packed_output_tokens = extract_packed_chunks(model, pack, prompt)
+            if results is None:
+                # The unusable packed request was still billed; keep it in the token totals.
+                if store is not None and (packed_input_tokens or packed_output_tokens):
+                    store.append_usage(packed_input_tokens, packed_output_tokens)
+                tqdm.write(f"Falling back to single-chunk requests for chunks {[index for index, _ in pack]}.")
+        if results is None:
+            results = {}
+            for index, chunk_text in pack:
+                prompt = select_prompt([chunk_text], f"Chunk {index}", system_prompt, selector)
+                results[index] = extract_chunk(model, index, chunk_text, prompt)
+        for index, _ in pack:
+            record(index, results[index])
+        return [results[index] for index, _ in pack]
+
+    for _, pack_results in run_in_order(worker, packs, max_in_flight, desc="Extracting from chunks"):
+        for chunk_relationships, _, _ in pack_results:
+            if chunk_relationships is not None:
                 newly_extracted_relationships.extend(chunk_relationships)
-                successfully_processed_indices.append(index)
-                tqdm.write(f"Chunk {index}: Extracted {len(chunk_relationships)} relationships. Input Tokens: {input_token_count}")
-            else:
-                tqdm.write(f"Warning: Chunk {index}: Received malformed data from API.")
-                failed_indices.append(index)
-        except (json.JSONDecodeError, Exception) as e:
-            tqdm.write(f"Warning: Chunk {index}: An error occurred. Details: {e}")
-            failed_indices.append(index)
-            
-    return newly_extracted_relationships, successfully_processed_indices, failed_indices, total_input_tokens, total_output_tokens
+
+    return newly_extracted_relationships
+
+def print_cost_estimate(chunk_texts: list[str], selector: SchemaSelector | None = None, chunks_per_request: int = CHUNKS_PER_REQUEST):
+    """Prints an offline estimate of the input tokens a run will consume (no API calls)."""
+    chunks_per_request = max(1, chunks_per_request)
+    packs = [chunk_texts[i:i + chunks_per_request] for i in range(0, len(chunk_texts), chunks_per_request)]
+    full_prompt_tokens = estimate_tokens(generate_system_prompt())
+    baseline_prompt_tokens = full_prompt_tokens * len(chunk_texts)
+    if selector is not None and selector.enabled:
+        prompt_tokens = 0
+        for pack in packs:
+            cued_types = set()
+            for text in pack:
+                cued_types.update(selector.select(text))
+            prompt_tokens += estimate_tokens(generate_system_prompt([rel for rel in RELATIONSHIP_TYPES if rel in cued_types]))
+    else:
+        prompt_tokens = full_prompt_tokens * len(packs)
+    text_tokens = sum(estimate_tokens(text) for text in chunk_texts)
+    print(f"Estimated input tokens: ~{prompt_tokens + text_tokens:,} over {len(packs)} requests (~{prompt_tokens:,} of schema prompt, ~{text_tokens:,} of book text).")
+    if prompt_tokens < baseline_prompt_tokens:
+        print(f"Schema pruning and chunk packing are expected to save ~{baseline_prompt_tokens - prompt_tokens:,} input tokens.")
 
 def run_script(script_path: str):
     # Using sys.executable ensures we use the python from the current virtual env
@@ -170,12 +314,22 @@ def display_status(stats: dict):
     print("\n--- Progress Status ---")
     print(f"Processed {processed_count} out of {total_chunks} chunks ({percentage:.2f}% complete).")
     print(f"Total relationships extracted so far: {stats.get('total_relationships_extracted', 0)}")
+    if "unique_relationships" in stats:
+        print(f"Unique relationships: {stats['unique_relationships']} ({stats.get('duplicate_relationships', 0)} duplicates from overlapping chunks merged)")
     print(f"Number of failed chunks: {failed_count}")
     if failed_count > 0:
         print(f"Failed chunk IDs: {failed_chunks}")
+    if stats.get("stale_chunks"):
+        print(f"Chunks with results that no longer match the book: {stats['stale_chunks']} (use 'Sync' to retract them)")
     print("\n--- Token Usage ---")
     print(f"Total Input Tokens Processed: {stats.get('total_input_tokens', 0):,}")
     print(f"Total Output Tokens Generated: {stats.get('total_output_tokens', 0):,}")
+    cache = get_response_cache()
+    if cache is not None:
+        cache_stats = cache.stats()
+        print("\n--- LLM Response Cache ---")
+        print(f"Hits: {cache_stats['hits']} | Misses: {cache_stats['misses']} (hit rate {cache_stats['hit_rate']:.1%}, this session)")
+        print(f"Entries on disk: {cache_stats['entries']} ({cache_stats['size_mb']:.1f} MB)")
     print(f"Last updated: {stats.get('last_updated', 'Never')}")
     print("-----------------------\n")
 
@@ -192,23 +346,29 @@ def extraction_menu():
         print(f"FATAL ERROR: Could not initialize Gemini or read book. Details: {e}")
         return
 
+    selector = load_schema_selector() if PRUNE_SCHEMA_PROMPT else None
+    # Results are keyed by chunk content hash, so edits to the book only invalidate the chunks that changed.
+    store = ResultsStore(RESULTS_LOG_PATH, chunk_hashes=book_chunks.hashes if book_chunks else [])
+    if store.is_empty() and os.path.exists(GRAPH_OUTPUT_PATH):
+        migrated = store.import_legacy(GRAPH_OUTPUT_PATH, STATS_PATH)
+        print(f"Migrated {migrated} previously extracted relationships into {RESULTS_LOG_PATH}.")
+
     while True:
         print("1. Enter a chunk range (e.g., '0-9')")
         print("2. Extract all remaining chunks")
         print("3. Retry failed chunks")
         print("4. Print status")
+        print(f"5. Compact results into {GRAPH_OUTPUT_PATH}")
+        print("6. Sync with an edited book (extract new/changed chunks, retract removed ones)")
         choice = input("Your choice (Press Enter to return to main menu): ").strip()
 
         if choice == "":
             break
         
-        stats = load_data(STATS_PATH, default_value={})
-        stats["total_chunks_in_book"] = total_chunks
-        graph_data = load_data(GRAPH_OUTPUT_PATH, default_value={"graph": []})
-        if "graph" not in graph_data or not isinstance(graph_data["graph"], list):
-            graph_data = {"graph": []}
-        processed_chunks_set = set(stats.get("processed_chunks", []))
-        failed_chunks_set = set(stats.get("failed_chunks", []))
+        # Progress is derived from the results log; the log itself is never reloaded or rewritten here.
+        stats = store.derive_stats()
+        processed_chunks_set = set(stats["processed_chunks"])
+        failed_chunks_set = set(stats["failed_chunks"])
 
         chunks_to_process_indices = []
         
@@ -234,6 +394,17 @@ def extraction_menu():
         elif choice == '4':
             display_status(stats)
             continue
+        elif choice == '5':
+            written = compact(RESULTS_LOG_PATH, GRAPH_OUTPUT_PATH, store.chunk_hashes)
+            print(f"Wrote {written} relationships to {GRAPH_OUTPUT_PATH}.")
+            continue
+        elif choice == '6':
+            new_positions, stale_hashes = store.diff()
+            for chunk_hash in stale_hashes:
+                store.retract(chunk_hash)
+            print(f"Retracted results of {len(stale_hashes)} chunks that no longer exist in the book.")
+            print(f"{len(new_positions)} chunks are new or changed since they were last extracted.")
+            chunks_to_process_indices = new_positions
         else:
             print("Invalid choice.")
             continue
@@ -242,30 +413,21 @@ def extraction_menu():
             print("No new chunks to process for the selected option.")
             continue
         
-        print(f"Found {len(chunks_to_process_indices)} chunks to process.")
+        print(f"Found {len(chunks_to_process_indices)} chunks to process ({CHUNKS_PER_REQUEST} per request, {MAX_IN_FLIGHT_REQUESTS} requests in flight).")
         chunks_with_indices = [(i, book_chunks[i]) for i in chunks_to_process_indices]
         system_prompt = generate_system_prompt()
-        new_relationships, successful_indices, newly_failed_indices, input_tokens, output_tokens = process_chunks(model, chunks_with_indices, system_prompt)
-        
-        processed_chunks_set.update(successful_indices)
-        failed_chunks_set.difference_update(successful_indices)
-        failed_chunks_set.update(newly_failed_indices)
-
-        if new_relationships:
-            graph_data["graph"].extend(new_relationships)
-        
-        stats["processed_chunks"] = sorted(list(processed_chunks_set))
-        stats["failed_chunks"] = sorted(list(failed_chunks_set))
-        stats["total_relationships_extracted"] = len(graph_data["graph"])
-        stats["last_updated"] = datetime.now().isoformat()
-        stats["total_input_tokens"] = stats.get("total_input_tokens", 0) + input_tokens
-        stats["total_output_tokens"] = stats.get("total_output_tokens", 0) + output_tokens
+        print_cost_estimate([text for _, text in chunks_with_indices], selector)
+        new_relationships = process_chunks(model, chunks_with_indices, system_prompt, store=store, selector=selector)
         
-        save_data(graph_data, GRAPH_OUTPUT_PATH)
+        stats = store.derive_stats()
         save_data(stats, STATS_PATH)
         
         print(f"\nRun complete. Added {len(new_relationships)} new relationships.")
+        if selector is not None and selector.enabled:
+            print(f"Schema pruning saved ~{selector.tokens_saved:,} input tokens over {selector.requests} requests this session.")
+        print(f"Run 'Compact results' (option 5) to refresh {GRAPH_OUTPUT_PATH} for population.")
         display_status(stats)
+    store.close()
 
 def main_menu():
     while True:
@@ -0,0 +1,379 @@
+"""
+Local HTTP service around the QA flow, so several users can ask questions at once.
+
+One asyncio process owns a single async Neo4j driver (and its connection pool), the
+Cypher cache, the question templates and the schema retriever. Requests are handled
+concurrently: model calls run in worker threads through llm_client (so the shared rate
+limiter still applies), queries run on the async driver, and the synthesized answer is
+streamed back to the client as the model produces it. Every request has a deadline.
+
+Endpoints:
+    POST /ask    {"question": "..."} -> newline-delimited JSON events, in order:
+                 {"event": "query", "source": "template" | "cache" | "model", "cypher": ..., ...}
+                 (a second query event, with "fallback": true, follows a template that found nothing)
+                 {"event": "results", "records": N, "rows": M, "limited": bool}
+                 {"event": "answer", "text": ...}   (one per streamed chunk)
+                 {"event": "done"}, or {"event": "error", "stage": ..., "message": ...}
+    GET  /stats  request counters and Cypher cache statistics
+
+Usage:
+    python qa_service.py
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+
+from dotenv import load_dotenv
+import google.generativeai as genai
+from neo4j import READ_ACCESS, AsyncGraphDatabase, Query
+
+# src/ modules import their siblings directly, so src/ itself must be importable.
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+from graph_schema import BASE_NODE_LABELS, RELATIONSHIP_TYPES
+from llm_client import generate_content
+from cypher_cache import CypherCache
+from qa_templates import match_template
+from schema_selector import QuestionSchemaRetriever, load_schema_selector
+from result_condenser import ResultCondenser, enforce_limit
+
+# --- Configuration ---
+load_dotenv()
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+genai.configure(api_key=GOOGLE_API_KEY)
+
+NEO4J_URI = os.getenv("NEO4J_URI")
+NEO4J_USER = os.getenv("NEO4J_USER")
+NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
+
+QA_SERVICE_HOST = os.getenv("QA_SERVICE_HOST", "127.0.0.1")
+QA_SERVICE_PORT = int(os.getenv("QA_SERVICE_PORT", "8765"))
+# Whole-request deadline: waiting for a slot, Cypher generation, the query and the streamed answer.
+QA_REQUEST_TIMEOUT_SECONDS = float(os.getenv("QA_REQUEST_TIMEOUT_SECONDS", "120"))
+# Server-side transaction timeout for the generated query.
+QA_QUERY_TIMEOUT_SECONDS = float(os.getenv("QA_QUERY_TIMEOUT_SECONDS", "30"))
+# Questions answered at the same time; further requests wait for a slot (within their deadline).
+QA_MAX_CONCURRENT_REQUESTS = int(os.getenv("QA_MAX_CONCURRENT_REQUESTS", "16"))
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "50"))
+HEADER_TIMEOUT_SECONDS = 10
+MAX_REQUEST_BYTES = 64 * 1024
+MODEL_NAME = 'gemini-1.5-pro-latest'
+
+
+class QAError(Exception):
+    """A failed QA stage, reported to the client as an error event."""
+
+    def __init__(self, stage: str, message: str):
+        super().__init__(message)
+        self.stage = stage
+
+
+# --- Prompt Generation ---
+def generate_cypher_prompt(node_labels: list[str] | None = None, relationship_types: list[str] | None = None):
+    """
+    Generates the final, definitive system prompt for the Text-to-Cypher AI.
+    `node_labels` and `relationship_types` restrict the schema shown to the parts relevant to one question.
+    """
+    node_labels_str = "`, `".join(node_labels or BASE_NODE_LABELS)
+    relationship_types_str = "`, `".join(relationship_types or RELATIONSHIP_TYPES)
+
+    return f"""
+    You are an expert Neo4j Cypher query generator. Your task is to convert a user's question in natural language into a Cypher query.
+
+    **DATABASE SCHEMA:**
+    - **Node Labels:** `{node_labels_str}`
+    - **Relationship Types:** `{relationship_types_str}`
+    - **Node Properties:** All nodes have a `name` property.
+    - **Relationship Properties:** Relationships can have properties like `reason`, `year`, `note`, `type`, etc. `year` is an integer (e.g. `r.year >= 1358`); numeric values are stored as numbers.
+
+    **CRITICAL INSTRUCTIONS:**
+    1.  You MUST use the provided Node Labels and Relationship Types.
+    2.  For searching node names, ALWAYS use the full-text index with a fuzzy match: `CALL db.index.fulltext.queryNodes("node_names", "some name~") YIELD node, score`
+    3.  Return ONLY the Cypher query.
+
+    **QUERYING STRATEGIES & EXAMPLES:**
+    - **Complex Actions:** For "opposition" or "support," search for a LIST of related relationship types.
+      - **Question:** "Who opposed Bani Sadr?"
+      - **Cypher:** `CALL db.index.fulltext.queryNodes("node_names", "بنی صدر~") YIELD node AS target MATCH (person)-[r:OPPOSED|CRITICIZED|DENOUNCED]->(target) RETURN person.name`
+
+    - **Relationship Properties:** For "why," "when," or "how," return the ENTIRE relationship object `r`. This is the most robust method.
+      - **Question:** "Why was Amir-Entezam accused?"
+      - **Cypher:** `CALL db.index.fulltext.queryNodes("node_names", "امیرانتظام~") YIELD node AS target MATCH (accuser)-[r:ACCUSED|ACCUSED_IN]-(target) RETURN r`
+    """
+
+
+def synthesis_prompt(question: str, table: str) -> str:
+    return f"""
+            You are an AI assistant. Your task is to answer a user's question based on the data provided.
+            Answer concisely in the same language as the original question.
+
+            Original Question: "{question}"
+
+            Data from Database (a table, most relevant rows first; "(xN)" marks a row returned N times):
+{table}
+
+            Answer:
+            """
+
+
+async def load_graph_statistics(driver) -> tuple[dict, dict]:
+    """Relationship-type and label counts from the count store (cheap, no graph scan)."""
+    try:
+        async with driver.session(database="neo4j") as session:
+            result = await session.run("CALL apoc.meta.stats() YIELD labels, relTypesCount RETURN labels, relTypesCount")
+            record = await result.single()
+        return dict(record["relTypesCount"]), dict(record["labels"])
+    except Exception as e:
+        print(f"WARNING: Could not read graph statistics ({e}). Schema retrieval will not use graph frequencies.")
+        return {}, {}
+
+
+# --- QA Service ---
+class QAService:
+    """Answers questions for concurrent HTTP clients, sharing one driver, cache and retriever."""
+
+    def __init__(self, driver, schema_retriever: QuestionSchemaRetriever, cypher_cache: CypherCache):
+        self.driver = driver
+        self.schema_retriever = schema_retriever
+        self.cypher_cache = cypher_cache
+        self.cypher_model = genai.GenerativeModel(MODEL_NAME)
+        self.synthesis_model = genai.GenerativeModel(MODEL_NAME)
+        self.slots = asyncio.Semaphore(QA_MAX_CONCURRENT_REQUESTS)
+        self.counters = Counter()
+        self.active = 0
+
+    async def plan_query(self, question: str, use_templates: bool = True) -> tuple[dict, str, dict]:
+        """Returns (query event, cypher, params): a template, a cached query, or a newly generated one."""
+        template_match = match_template(question) if use_templates else None
+        if template_match:
+            intent, cypher, params = template_match
+            return {"source": "template", "intent": intent, "params": params}, cypher, params
+
+        cypher = self.cypher_cache.get(question)
+        if cypher is not None:
+            return {"source": "cache"}, cypher, {}
+
+        # Only the labels and relationship types relevant to this question go into the prompt.
+        relationship_types = self.schema_retriever.select_types(question)
+        prompt = generate_cypher_prompt(self.schema_retriever.select_labels(), relationship_types)
+        prompt += f"\n**User Question:** \"{question}\""
+        try:
+            response = await asyncio.to_thread(generate_content, self.cypher_model, prompt)
+            cypher = response.text.strip().replace("```cypher", "").replace("```", "")
+        except Exception as e:
+            raise QAError("generation", f"An error occurred during Cypher generation: {e}")
+        if "ERROR" in cypher or not cypher:
+            raise QAError("generation", "AI could not generate a valid query for this question.")
+        offered = f"{len(relationship_types)}/{len(RELATIONSHIP_TYPES)}"
+        return {"source": "model", "offered_types": offered}, cypher, {}
+
+    async def run_query(self, cypher: str, params: dict) -> ResultCondenser:
+        """Streams the (LIMIT-capped) query's records into a condenser, in a read-only session."""
+        condenser = ResultCondenser()
+        # Generated and cached queries must never modify the graph.
+        async with self.driver.session(database="neo4j", default_access_mode=READ_ACCESS) as session:
+            result = await session.run(Query(enforce_limit(cypher), timeout=QA_QUERY_TIMEOUT_SECONDS), params)
+            async for record in result:
+                if not condenser.add(record):
+                    break
+        return condenser
+
+    async def stream_answer(self, prompt: str):
+        """
+        Yields the synthesized answer chunk by chunk. The blocking streaming call runs in a
+        worker thread and hands chunks to the event loop as they arrive.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        stopped = threading.Event()
+
+        def produce():
+            try:
+                for chunk in generate_content(self.synthesis_model, prompt, stream=True):
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk.text)
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+        loop.run_in_executor(None, produce)
+        try:
+            while (item := await chunks.get()) is not None:
+                if isinstance(item, Exception):
+                    raise QAError("synthesis", f"An error occurred during answer synthesis: {item}")
+                yield item
+        finally:
+            # A cancelled or timed-out request stops the producer at its next chunk.
+            stopped.set()
+
+    async def execute(self, question: str, query_event: dict, cypher: str, params: dict, emit) -> ResultCondenser:
+        """Announces and runs one planned query, keeping the Cypher cache in step with the outcome."""
+        self.counters[query_event["source"]] += 1
+        await emit({"event": "query", "cypher": cypher, **query_event})
+        try:
+            condenser = await self.run_query(cypher, params)
+        except Exception as e:
+            if query_event["source"] == "cache":
+                await asyncio.to_thread(self.cypher_cache.discard, question)
+            raise QAError("execution", f"An error occurred during database execution: {e}")
+        if query_event["source"] == "model":
+            await asyncio.to_thread(self.cypher_cache.put, question, cypher)
+        return condenser
+
+    async def answer(self, question: str, emit):
+        """Runs the QA flow for one question, passing each event to `emit`."""
+        query_event, cypher, params = await self.plan_query(question)
+        condenser = await self.execute(question, query_event, cypher, params, emit)
+        if not condenser.read and query_event["source"] == "template":
+            # The template's name lookup found nothing; the model may still spell or phrase it better.
+            query_event, cypher, params = await self.plan_query(question, use_templates=False)
+            condenser = await self.execute(question, {**query_event, "fallback": True}, cypher, params, emit)
+
+        table = condenser.table()
+        await emit({"event": "results", "records": condenser.read, "rows": condenser.kept,
+                    "limited": condenser.read >= condenser.max_rows})
+        if not condenser.read:
+            return
+        async with aclosing(self.stream_answer(synthesis_prompt(question, table))) as chunks:
+            async for text in chunks:
+                await emit({"event": "answer", "text": text})
+
+    async def handle_ask(self, body: bytes, writer):
+        try:
+            question = json.loads(body)["question"].strip()
+        except (ValueError, KeyError, TypeError, AttributeError):
+            await send_json(writer, 400, {"error": 'Expected a JSON body like {"question": "..."}.'})
+            return
+
+        async def emit(event: dict):
+            writer.write(json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n")
+            await writer.drain()
+
+        writer.write(response_head(200, "application/x-ndjson"))
+        self.counters["requests"] += 1
+        try:
+            async with asyncio.timeout(QA_REQUEST_TIMEOUT_SECONDS):
+                async with self.slots:
+                    self.active += 1
+                    try:
+                        await self.answer(question, emit)
+                    finally:
+                        self.active -= 1
+            await emit({"event": "done"})
+        except QAError as e:
+            self.counters["errors"] += 1
+            await emit({"event": "error", "stage": e.stage, "message": str(e)})
+        except TimeoutError:
+            self.counters["timeouts"] += 1
+            await emit({"event": "error", "stage": "timeout",
+                        "message": f"The request did not finish within {QA_REQUEST_TIMEOUT_SECONDS:.0f} seconds."})
+        except ConnectionError:
+            raise
+        except Exception as e:
+            # The 200 head is already sent; end the stream with an error event rather than silently.
+            self.counters["errors"] += 1
+            print(f"WARNING: Request failed unexpectedly: {e}")
+            await emit({"event": "error", "stage": "internal", "message": f"An internal error occurred: {e}"})
+
+    async def handle_connection(self, reader, writer):
+        try:
+            try:
+                async with asyncio.timeout(HEADER_TIMEOUT_SECONDS):
+                    method, path, headers = await read_request_head(reader)
+                    length = int(headers.get("content-length", 0))
+                    if length > MAX_REQUEST_BYTES:
+                        await send_json(writer, 413, {"error": "Request body too large."})
+                        return
+                    body = await reader.readexactly(length) if length else b""
+            except (ValueError, TimeoutError, asyncio.IncompleteReadError):
+                await send_json(writer, 400, {"error": "Malformed or incomplete request."})
+                return
+
+            if (method, path) == ("POST", "/ask"):
+                await self.handle_ask(body, writer)
+            elif (method, path) == ("GET", "/stats"):
+                await send_json(writer, 200, {"active": self.active, **self.counters, "cypher_cache": self.cypher_cache.stats()})
+            else:
+                await send_json(writer, 404, {"error": f"No route for {method} {path}."})
+        except ConnectionError:
+            # The client went away mid-answer; nothing left to report to.
+            pass
+        except Exception as e:
+            print(f"WARNING: Request failed unexpectedly: {e}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+# --- Minimal HTTP/1.1 helpers ---
+# Responses are sent with `Connection: close`; a streamed body ends when the connection does.
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Content Too Large"}
+
+
+async def read_request_head(reader) -> tuple[str, str, dict]:
+    request_line = (await reader.readline()).decode("latin-1")
+    method, path, _ = request_line.split(" ", 2)
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return method.upper(), path.split("?", 1)[0], headers
+
+
+def response_head(status: int, content_type: str, length: int | None = None) -> bytes:
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}", f"Content-Type: {content_type}; charset=utf-8",
+             "Connection: close", "Cache-Control: no-cache"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_json(writer, status: int, payload: dict):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    writer.write(response_head(status, "application/json", len(body)) + body)
+    await writer.drain()
+
+
+# --- Main ---
+async def serve():
+    driver = AsyncGraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD),
+                                       max_connection_pool_size=NEO4J_POOL_SIZE)
+    try:
+        await driver.verify_connectivity()
+    except Exception as e:
+        print(f"FATAL: Could not connect to Neo4j database. Error: {e}")
+        await driver.close()
+        return
+
+    # Model calls and streaming answers each hold a worker thread while they run.
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2 * QA_MAX_CONCURRENT_REQUESTS))
+    type_counts, label_counts = await load_graph_statistics(driver)
+    service = QAService(driver, QuestionSchemaRetriever(load_schema_selector(), type_counts, label_counts), CypherCache())
+
+    server = await asyncio.start_server(service.handle_connection, QA_SERVICE_HOST, QA_SERVICE_PORT)
+    print(f"QA service listening on http://{QA_SERVICE_HOST}:{QA_SERVICE_PORT} (Ctrl+C to stop).")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await driver.close()
+        service.cypher_cache.flush()
+        stats = service.cypher_cache.stats()
+        print(f"\nServed {service.counters['requests']} questions. Cypher cache: {stats['hits']} hits, "
+              f"{stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), {stats['entries']} cached questions.")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print("QA service stopped.")
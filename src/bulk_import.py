@@ -0,0 +1,173 @@
+"""
+Offline bulk load: converts the validated extracted_graph.json into CSV files for `neo4j-admin database import`.
+
+A fresh load (the usual case, since populate.py wipes the database first) is much faster
+through the offline importer than through transactional Cypher. The JSON is streamed
+twice: the first pass collects the distinct nodes and the relationship property columns,
+the second writes the relationship rows. Rows are validated, labelled and typed
+exactly as populate.py does, so both paths produce the same graph.
+
+Usage:
+    python src/bulk_import.py
+then follow the printed docker compose commands (the database must be stopped while importing).
+"""
+import csv
+import json
+import os
+import re
+
+from populate import JSON_FILE_PATH, add_node, ensure_validated, iter_rows, node_key
+
+IMPORT_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'import')
+# Where IMPORT_DIR is mounted inside the neo4j container (see docker-compose.yml).
+CONTAINER_IMPORT_DIR = "/import"
+NODE_FILES = ("nodes_header.csv", "nodes.csv")
+RELATIONSHIP_FILES = ("relationships_header.csv", "relationships.csv")
+# Separator of the :LABEL column and of array properties, as expected by neo4j-admin.
+ARRAY_DELIMITER = ";"
+# Property names become CSV header fields, where ':' would be read as a type annotation.
+HEADER_UNSAFE = re.compile(r'[:,"\s]')
+
+
+def header_name(key) -> str:
+    return HEADER_UNSAFE.sub("_", str(key))
+
+
+def value_kind(value) -> str | None:
+    """The neo4j-admin column type a property value needs; None for values that do not constrain it."""
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "long"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, list):
+        kinds = {value_kind(item) for item in value}
+        if not value or len(kinds) != 1 or any(ARRAY_DELIMITER in str(item) for item in value):
+            return "string" if value else None
+        return f"{kinds.pop()}[]"
+    return "string"
+
+
+def column_type(kinds: set) -> str:
+    """One type per column: numeric columns mixing longs and doubles become double, anything else mixed is a string."""
+    kinds.discard(None)
+    if len(kinds) == 1:
+        return kinds.pop()
+    if kinds == {"long", "double"}:
+        return "double"
+    return "string"
+
+
+def csv_value(value, kind: str):
+    if value is None:
+        return ""
+    if kind.endswith("[]"):
+        return ARRAY_DELIMITER.join(csv_value(item, kind[:-2]) for item in value)
+    if isinstance(value, list):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def collect_nodes_and_columns() -> tuple[dict, dict, int]:
+    """
+    Pass 1: returns the distinct nodes (key -> labels), the relationship property columns
+    (name -> neo4j-admin type) and the skipped row count. Nodes are keyed like populate.py's,
+    so no two exported nodes share a name under a uniquely constrained label.
+    """
+    nodes = {}
+    columns = {}
+    skipped = 0
+    for row in iter_rows("Collecting Nodes"):
+        if row is None:
+            skipped += 1
+            continue
+        add_node(nodes, row["head_labels"], row["head_name"])
+        add_node(nodes, row["tail_labels"], row["tail_name"])
+        if isinstance(row["rel_props"], dict):
+            for key, value in row["rel_props"].items():
+                columns.setdefault(header_name(key), set()).add(value_kind(value))
+    return nodes, {name: column_type(kinds) for name, kinds in columns.items()}, skipped
+
+
+def write_nodes(nodes: dict, output_dir: str) -> dict:
+    """Writes the node header and rows; returns the node key -> import id map."""
+    header_path, rows_path = (os.path.join(output_dir, name) for name in NODE_FILES)
+    with open(header_path, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerow(["nodeId:ID", "name", ":LABEL"])
+
+    node_ids = {}
+    with open(rows_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        for node_id, (key, labels) in enumerate(nodes.items()):
+            node_ids[key] = node_id
+            writer.writerow([node_id, key[1], ARRAY_DELIMITER.join(labels)])
+    return node_ids
+
+
+def write_relationships(node_ids: dict, columns: dict, output_dir: str) -> int:
+    """
+    Pass 2: writes the relationship header and rows. Like the MERGE in populate.py, only the
+    first relationship of a given type between two nodes is kept. Its record_keys holds only
+    that first record's key; a later delta run of populate.py adds the keys of the others.
+    """
+    header_path, rows_path = (os.path.join(output_dir, name) for name in RELATIONSHIP_FILES)
+    with open(header_path, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerow([":START_ID", ":END_ID", ":TYPE", "record_keys:string[]",
+                                *(f"{name}:{kind}" for name, kind in columns.items())])
+
+    seen = set()
+    written = 0
+    with open(rows_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        for row in iter_rows("Writing Relationships"):
+            if row is None:
+                continue
+            head_id = node_ids[node_key(row["head_labels"], row["head_name"])]
+            tail_id = node_ids[node_key(row["tail_labels"], row["tail_name"])]
+            identity = (head_id, row["rel_type"], tail_id)
+            if identity in seen:
+                continue
+            seen.add(identity)
+
+            props = row["rel_props"] if isinstance(row["rel_props"], dict) else {}
+            values = {header_name(key): value for key, value in props.items()}
+            writer.writerow([head_id, tail_id, row["rel_type"], row["record_key"], 
+                             *(csv_value(values.get(name), kind) for name, kind in columns.items())])
+            written += 1
+    return written
+
+
+def import_command() -> str:
+    nodes = ",".join(f"{CONTAINER_IMPORT_DIR}/{name}" for name in NODE_FILES)
+    relationships = ",".join(f"{CONTAINER_IMPORT_DIR}/{name}" for name in RELATIONSHIP_FILES)
+    return (
+        "docker compose stop neo4j\n"
+        "docker compose run --rm neo4j neo4j-admin database import full "
+        # Extracted property values (notes, reasons) can span several lines.
+        f"--nodes={nodes} --relationships={relationships} --multiline-fields=true --overwrite-destination neo4j\n"
+        "docker compose start neo4j"
+    )
+
+
+def export_csv(output_dir: str = IMPORT_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+    ensure_validated()
+    print(f"Exporting {JSON_FILE_PATH} to {output_dir}...")
+    nodes, columns, skipped = collect_nodes_and_columns()
+    node_ids = write_nodes(nodes, output_dir)
+    written = write_relationships(node_ids, columns, output_dir)
+
+    print(f"\n--- Export Complete ---")
+    print(f"Nodes written: {len(node_ids)}")
+    print(f"Relationships written: {written}")
+    print(f"Total malformed relationships skipped: {skipped}")
+    print("\nTo load the files into the docker-compose database (this replaces its contents):")
+    print(import_command())
+    print("\nThen run `python src/populate.py --constraints-only` to create the constraints and indexes.")
+
+
+if __name__ == "__main__":
+    export_csv()
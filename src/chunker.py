@@ -0,0 +1,179 @@
+"""
+Streaming, boundary-aware chunking of the source book.
+
+The book is read in fixed-size blocks rather than loaded whole, and every chunk ends
+on the best natural break available near the target size: a paragraph break, then a
+Farsi/Latin sentence terminator, then plain whitespace. The byte span of each chunk
+is persisted in a small sidecar index, so later runs (resuming, extracting a single
+range) read only the chunks they need instead of re-reading and re-chunking the book.
+
+Boundaries are content-defined: among the candidate breaks near the target size, the
+first one whose surrounding text hashes to a "cut point" is chosen. Because that choice
+depends only on nearby text, an edit early in the book changes the chunks around the
+edit and then re-synchronizes, so every chunk after it keeps its content hash.
+"""
+import hashlib
+import json
+import os
+
+PARAGRAPH_BREAK = "\n\n"
+# Sentence terminators, Farsi first: question mark, semicolon, full stop (Urdu/Farsi), then Latin.
+SENTENCE_BREAKS = ("؟", "؛", "۔", ".", "!", "?", "…")
+# A chunk is never cut earlier than this fraction of the target size to reach a nicer boundary.
+MIN_CHUNK_FRACTION = 0.5
+# Content-defined cut points are only looked for after this fraction of the target size.
+CDC_MIN_FRACTION = 0.7
+# Roughly one in CDC_DIVISOR candidate breaks is a cut point.
+CDC_DIVISOR = 16
+CDC_CONTEXT_CHARS = 48
+READ_BLOCK_CHARS = 64 * 1024
+# Bumped whenever boundary selection changes, so stale indexes are rebuilt.
+INDEX_VERSION = 2
+
+
+def is_cut_point(text: str, position: int) -> bool:
+    context = text[max(0, position - CDC_CONTEXT_CHARS):position].encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(context, digest_size=4).digest(), 'big') % CDC_DIVISOR == 0
+
+
+def find_content_defined_cut(text: str, min_pos: int, max_pos: int) -> int | None:
+    """Returns the first paragraph or sentence break in text[min_pos:max_pos] that is a cut point, if any."""
+    for position in range(min_pos, max_pos):
+        if text.startswith(PARAGRAPH_BREAK, position - len(PARAGRAPH_BREAK)) or \
+                (text[position - 1] in SENTENCE_BREAKS and (position == len(text) or text[position].isspace())):
+            if is_cut_point(text, position):
+                return position
+    return None
+
+
+def find_cut(text: str, min_pos: int, max_pos: int) -> int:
+    """Returns the best position in text[min_pos:max_pos] to end a chunk (exclusive)."""
+    paragraph = text.rfind(PARAGRAPH_BREAK, min_pos, max_pos)
+    if paragraph != -1:
+        return paragraph + len(PARAGRAPH_BREAK)
+    best = -1
+    for mark in SENTENCE_BREAKS:
+        best = max(best, text.rfind(mark, min_pos, max_pos - 1))
+    if best != -1:
+        return best + 1
+    for position in range(max_pos - 1, min_pos - 1, -1):
+        if text[position].isspace():
+            return position + 1
+    return max_pos
+
+
+def find_overlap_start(text: str, min_pos: int, cut: int) -> int:
+    """Returns where the next chunk should start so it overlaps the previous one on a sentence start."""
+    for position in range(min_pos, cut):
+        if text[position] in SENTENCE_BREAKS or text[position] == "\n":
+            start = position + 1
+            while start < cut and text[start].isspace():
+                start += 1
+            if start < cut:
+                return start
+    for position in range(min_pos, cut):
+        if text[position].isspace():
+            return position + 1
+    return min_pos
+
+
+def iter_chunk_spans(file_path: str, chunk_size: int, overlap: int):
+    """
+    Streams the file and yields (start_byte, end_byte, text) for each chunk.
+    Memory use is bounded by the chunk size, independent of the book's size.
+    """
+    buffer = ""
+    buffer_start_byte = 0
+    at_eof = False
+    # newline='' keeps line endings untouched, so character and byte offsets stay in sync.
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        while True:
+            while not at_eof and len(buffer) < chunk_size:
+                block = f.read(READ_BLOCK_CHARS)
+                if not block:
+                    at_eof = True
+                buffer += block
+            if not buffer:
+                return
+
+            if at_eof and len(buffer) <= chunk_size:
+                cut = len(buffer)
+            else:
+                cut = find_content_defined_cut(buffer, int(chunk_size * CDC_MIN_FRACTION), chunk_size)
+                if cut is None:
+                    cut = find_cut(buffer, int(chunk_size * MIN_CHUNK_FRACTION), chunk_size)
+            chunk_text = buffer[:cut]
+            end_byte = buffer_start_byte + len(chunk_text.encode('utf-8'))
+            yield buffer_start_byte, end_byte, chunk_text
+
+            if cut >= len(buffer) and at_eof:
+                return
+            next_start = find_overlap_start(buffer, max(1, cut - overlap), cut) if overlap > 0 else cut
+            buffer_start_byte += len(buffer[:next_start].encode('utf-8'))
+            buffer = buffer[next_start:]
+
+
+def read_chunk(file_path: str, start_byte: int, end_byte: int) -> str:
+    with open(file_path, 'rb') as f:
+        f.seek(start_byte)
+        return f.read(end_byte - start_byte).decode('utf-8')
+
+
+def chunk_hash(chunk_text: str) -> str:
+    return hashlib.sha256(chunk_text.encode('utf-8')).hexdigest()
+
+
+def index_path_for(file_path: str) -> str:
+    return f"{file_path}.chunks.json"
+
+
+def load_or_build_index(file_path: str, chunk_size: int, overlap: int) -> list[list]:
+    """
+    Returns the [start_byte, end_byte, content_hash] of every chunk, reusing the sidecar index
+    when it was built for the same file (size and mtime) and the same chunking parameters.
+    """
+    stat = os.stat(file_path)
+    fingerprint = {
+        "version": INDEX_VERSION,
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+        "chunk_size": chunk_size,
+        "overlap": overlap,
+    }
+    index_path = index_path_for(file_path)
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if all(index.get(key) == value for key, value in fingerprint.items()):
+                return index["chunks"]
+        except (json.JSONDecodeError, IOError, KeyError):
+            pass
+
+    spans = [[start, end, chunk_hash(text)] for start, end, text in iter_chunk_spans(file_path, chunk_size, overlap)]
+    try:
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump({**fingerprint, "chunks": spans}, f)
+    except IOError as e:
+        print(f"WARNING: Could not save chunk index to {index_path}: {e}")
+    return spans
+
+
+class BookChunks:
+    """
+    Lazy, list-like view of a book's chunks backed by the byte-offset index.
+    `len()` and indexing work like the old list of strings, but each chunk is read from disk on access.
+    `hashes` holds the content hash of every chunk, in order.
+    """
+
+    def __init__(self, file_path: str, chunk_size: int, overlap: int):
+        self.file_path = file_path
+        self.spans = load_or_build_index(file_path, chunk_size, overlap)
+        self.hashes = [span[2] for span in self.spans]
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def __getitem__(self, index: int) -> str:
+        start_byte, end_byte, _ = self.spans[index]
+        return read_chunk(self.file_path, start_byte, end_byte)
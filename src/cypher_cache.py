@@ -0,0 +1,116 @@
+"""
+Persistent question -> Cypher cache for the QA interface.
+
+Questions are keyed by their normalized form (Arabic/Persian letter and digit folding,
+whitespace and trailing punctuation), so a repeated or trivially re-typed question skips
+the Cypher-generation round trip. Entries remember the schema version they were generated
+against and are dropped once graph_schema.py changes. The cache is one small JSON file,
+kept in least-recently-used order and trimmed to a fixed number of entries. It is saved
+whenever an entry is added or dropped; the recency of cache hits is saved by `flush`.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from farsi_text import normalize
+from schema_registry import SCHEMA_VERSION
+
+CYPHER_CACHE_PATH = os.getenv("CYPHER_CACHE_PATH", os.path.join(os.path.dirname(__file__), '..', 'data', 'cypher_cache.json'))
+CYPHER_CACHE_MAX_ENTRIES = int(os.getenv("CYPHER_CACHE_MAX_ENTRIES", "2000"))
+QUESTION_PUNCTUATION = "؟?!.،,؛;:«»\"'()"
+
+
+def question_key(question: str) -> str:
+    return normalize(question).strip(QUESTION_PUNCTUATION + " ").lower()
+
+
+class CypherCache:
+    """LRU map from normalized question to generated Cypher, persisted across sessions."""
+
+    def __init__(self, path: str = CYPHER_CACHE_PATH, max_entries: int = CYPHER_CACHE_MAX_ENTRIES,
+                 schema_version: str = SCHEMA_VERSION):
+        self.path = path
+        self.max_entries = max_entries
+        self.schema_version = schema_version
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Set when a hit reordered the entries since the last save.
+        self.dirty = False
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"WARNING: Could not read {self.path}: {e}. Starting with an empty Cypher cache.")
+            return
+        if data.get("schema_version") != self.schema_version:
+            # Generated against a different schema; its labels and relationship types may no longer exist.
+            return
+        # Stored oldest first, so insertion order is LRU order.
+        for key, entry in data.get("entries", []):
+            self.entries[key] = entry
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"schema_version": self.schema_version, "entries": list(self.entries.items())}, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+        self.dirty = False
+
+    def _save_or_warn(self):
+        try:
+            self._save()
+        except IOError as e:
+            print(f"WARNING: Could not save the Cypher cache to {self.path}: {e}")
+
+    def get(self, question: str) -> str | None:
+        key = question_key(question)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.dirty = True
+            self.hits += 1
+            return entry["cypher"]
+
+    def put(self, question: str, cypher: str):
+        key = question_key(question)
+        with self.lock:
+            self.entries[key] = {"cypher": cypher, "question": question, "created": time.time()}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._save_or_warn()
+
+    def discard(self, question: str):
+        """Drops an entry whose Cypher turned out not to run."""
+        with self.lock:
+            if self.entries.pop(question_key(question), None) is not None:
+                self._save_or_warn()
+
+    def flush(self):
+        """Saves the LRU order if cache hits changed it since the last save."""
+        with self.lock:
+            if self.dirty:
+                self._save_or_warn()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "entries": len(self.entries),
+            }
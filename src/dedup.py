@@ -0,0 +1,72 @@
+"""
+Deduplication of extracted relationships.
+
+With overlapping chunks the same sentence is often extracted twice, by neighbouring
+chunks. Relationships are identified by a hash of their normalized (head, relation,
+tail, properties), so trivially different spellings of the same row (Arabic vs Persian
+letters, extra whitespace, relation case) collapse to one key. Duplicates are counted
+rather than kept: the compacted graph carries each relationship once with an
+`occurrences` count.
+"""
+import hashlib
+import json
+from collections import Counter
+
+from farsi_text import normalize
+
+
+def normalize_value(value):
+    if isinstance(value, str):
+        return normalize(value)
+    if isinstance(value, dict):
+        return {str(k).strip().lower(): normalize_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [normalize_value(v) for v in value]
+    return value
+
+
+def relationship_key(rel) -> str:
+    """Stable hash of a relationship's normalized (head, relation, tail, properties)."""
+    if isinstance(rel, dict):
+        relation = rel.get("relation")
+        identity = [
+            normalize_value(rel.get("head")),
+            relation.strip().upper() if isinstance(relation, str) else relation,
+            normalize_value(rel.get("tail")),
+            normalize_value(rel.get("properties") or {}),
+        ]
+    else:
+        identity = rel
+    encoded = json.dumps(identity, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class RelationshipDeduplicator:
+    """Incrementally counts occurrences per relationship key as chunk results arrive."""
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def add(self, keys: list[str]) -> int:
+        """Adds one chunk's keys; returns how many of them were not seen before."""
+        new = 0
+        for key in keys:
+            if self.counts[key] == 0:
+                new += 1
+            self.counts[key] += 1
+        return new
+
+    def remove(self, keys: list[str]) -> None:
+        """Withdraws keys, e.g. when a chunk's earlier result is superseded by a re-extraction."""
+        for key in keys:
+            self.counts[key] -= 1
+            if self.counts[key] <= 0:
+                del self.counts[key]
+
+    @property
+    def unique_count(self) -> int:
+        return len(self.counts)
+
+    @property
+    def duplicate_count(self) -> int:
+        return sum(self.counts.values()) - len(self.counts)
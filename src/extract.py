@@ -7,6 +7,9 @@ import google.generativeai as genai
 from tqdm import tqdm
 import config
 from graph_schema import NodeLabel, RelationshipLabel
+from extraction_engine import run_in_order
+from llm_client import generate_content, is_graph_response
+from chunker import BookChunks
 
 # --- File Paths ---
 BOOK_PATH = os.path.join("data", "book.txt")
@@ -16,6 +19,7 @@ STATS_PATH = os.path.join("data", "progress_stats.json")
 # --- Processing Parameters ---
 CHUNK_SIZE = 10000
 CHUNK_OVERLAP = 500
+MAX_IN_FLIGHT_REQUESTS = int(os.getenv("MAX_IN_FLIGHT_REQUESTS", "8"))
 
 def generate_system_prompt() -> str:
     node_labels_str = ", ".join([f"`{label.value}`" for label in NodeLabel])
@@ -64,20 +68,11 @@ def generate_system_prompt() -> str:
 به متن ورودی که در ادامه می‌آید به دقت توجه کنید و استخراج را فقط بر اساس آن انجام دهید.
 """
 
-def read_book_chunks(file_path: str, chunk_size: int, overlap: int) -> List[str]:
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
-    except FileNotFoundError:
+def read_book_chunks(file_path: str, chunk_size: int, overlap: int) -> Union[BookChunks, List[str]]:
+    if not os.path.exists(file_path):
         print(f"ERROR: The file {file_path} was not found.")
         return []
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += chunk_size - overlap
-    return chunks
+    return BookChunks(file_path, chunk_size, overlap)
 
 def load_data(file_path: str, default_value: Union[List, Dict]) -> Union[List, Dict]:
     if not os.path.exists(file_path):
@@ -102,31 +97,41 @@ def save_data(data: Union[List, Dict], file_path: str) -> None:
     except IOError as e:
         print(f"ERROR: Failed to save data to {file_path}: {e}")
 
-def process_chunks(model, chunks_to_process: List[Tuple[int, str]], system_prompt: str) -> Tuple[List[Dict], List[int], List[int]]:
+def extract_chunk(model, index: int, chunk_text: str, system_prompt: str) -> Union[List[Dict], None]:
+    """Extracts the triplets of a single chunk, or returns None if the chunk failed."""
+    try:
+        full_prompt = f"{system_prompt}\n\n**متن ورودی برای تحلیل:**\n\n---\n{chunk_text}\n---"
+        response = generate_content(model, full_prompt, validate=is_graph_response)
+        response_text = response.text.strip().replace("```json", "").replace("```", "")
+        data = json.loads(response_text)
+        
+        if isinstance(data, dict) and "graph" in data and isinstance(data["graph"], list):
+            chunk_triplets = data["graph"]
+            tqdm.write(f"Chunk {index}: Extracted {len(chunk_triplets)} triplets.")
+            return chunk_triplets
+        tqdm.write(f"WARNING: Chunk {index}: Received malformed data from API.")
+    except json.JSONDecodeError:
+        tqdm.write(f"WARNING: Chunk {index}: Failed to decode JSON from API response.")
+    except Exception as e:
+        tqdm.write(f"ERROR: An error occurred during API call for chunk {index}: {e}")
+    return None
+
+def process_chunks(model, chunks_to_process: List[Tuple[int, str]], system_prompt: str, max_in_flight: int = MAX_IN_FLIGHT_REQUESTS) -> Tuple[List[Dict], List[int], List[int]]:
     newly_extracted_triplets = []
     successfully_processed_indices = []
     failed_indices = []
-    for index, chunk_text in tqdm(chunks_to_process, desc="Extracting from chunks"):
-        try:
-            full_prompt = f"{system_prompt}\n\n**متن ورودی برای تحلیل:**\n\n---\n{chunk_text}\n---"
-            response = model.generate_content(full_prompt)
-            response_text = response.text.strip().replace("```json", "").replace("```", "")
-            data = json.loads(response_text)
-            
-            if isinstance(data, dict) and "graph" in data and isinstance(data["graph"], list):
-                chunk_triplets = data["graph"]
-                newly_extracted_triplets.extend(chunk_triplets)
-                successfully_processed_indices.append(index)
-                tqdm.write(f"Chunk {index}: Extracted {len(chunk_triplets)} triplets.")
-            else:
-                tqdm.write(f"WARNING: Chunk {index}: Received malformed data from API.")
-                failed_indices.append(index)
-        except json.JSONDecodeError:
-            tqdm.write(f"WARNING: Chunk {index}: Failed to decode JSON from API response.")
-            failed_indices.append(index)
-        except Exception as e:
-            tqdm.write(f"ERROR: An error occurred during API call for chunk {index}: {e}")
+
+    def worker(item: Tuple[int, str]) -> Union[List[Dict], None]:
+        index, chunk_text = item
+        return extract_chunk(model, index, chunk_text, system_prompt)
+
+    # Requests run concurrently, but results arrive here in chunk order.
+    for (index, _), chunk_triplets in run_in_order(worker, chunks_to_process, max_in_flight, desc="Extracting from chunks"):
+        if chunk_triplets is None:
             failed_indices.append(index)
+        else:
+            newly_extracted_triplets.extend(chunk_triplets)
+            successfully_processed_indices.append(index)
     return newly_extracted_triplets, successfully_processed_indices, failed_indices
 
 def display_status(stats: Dict[str, Any]) -> None:
@@ -0,0 +1,46 @@
+"""
+Bounded concurrent execution for per-chunk LLM work.
+
+A chunk request spends almost all of its time waiting on the network, so a small
+thread pool keeps several requests in flight at once. Results are still handed
+back in the original chunk order so callers can keep their bookkeeping simple.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from tqdm import tqdm
+
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+def run_in_order(worker, items, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, desc: str = "Processing"):
+    """
+    Applies `worker` to every item with at most `max_in_flight` calls running
+    concurrently, and yields `(item, result)` pairs in the order of `items`.
+
+    Results that finish early are buffered until every earlier item is done,
+    so one slow request never stops new requests from being started.
+    """
+    items = list(items)
+    max_in_flight = max(1, int(max_in_flight))
+    finished = {}
+    next_to_submit = 0
+    next_to_yield = 0
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor, \
+            tqdm(total=len(items), desc=desc) as progress:
+        in_flight = {}
+        while next_to_yield < len(items):
+            while next_to_submit < len(items) and len(in_flight) < max_in_flight:
+                future = executor.submit(worker, items[next_to_submit])
+                in_flight[future] = next_to_submit
+                next_to_submit += 1
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                position = in_flight.pop(future)
+                # .result() re-raises any exception the worker did not handle itself.
+                finished[position] = future.result()
+                progress.update(1)
+
+            while next_to_yield in finished:
+                yield items[next_to_yield], finished.pop(next_to_yield)
+                next_to_yield += 1
@@ -0,0 +1,66 @@
+"""
+Small, dependency-free helpers for normalizing and tokenizing Farsi text.
+
+Extracted text and user input mix Arabic and Persian code points for the same letters
+(ي/ی, ك/ک), Persian and Arabic-Indic digits, and zero-width non-joiners inside words.
+Folding those variants lets lexical lookups match regardless of how a word was typed.
+"""
+import re
+
+CHARACTER_FOLDING = str.maketrans({
+    "ي": "ی", "ى": "ی", "ئ": "ی",
+    "ك": "ک",
+    "ة": "ه", "ۀ": "ه",
+    "أ": "ا", "إ": "ا", "ٱ": "ا", "آ": "ا",
+    "ؤ": "و",
+    # Persian and Arabic-Indic digits -> ASCII digits
+    "۰": "0", "۱": "1", "۲": "2", "۳": "3", "۴": "4", "۵": "5", "۶": "6", "۷": "7", "۸": "8", "۹": "9",
+    "٠": "0", "١": "1", "٢": "2", "٣": "3", "٤": "4", "٥": "5", "٦": "6", "٧": "7", "٨": "8", "٩": "9",
+    # Zero-width non-joiner / joiner and tatweel separate or decorate word parts
+    "‌": " ", "‍": "", "ـ": "",
+})
+# Arabic diacritics (harakat), which are optional in Farsi writing.
+DIACRITICS = re.compile(r"[ً-ٰٟ]")
+WORD = re.compile(r"[\w]+", re.UNICODE)
+
+# Prepositions, conjunctions and light verbs that carry no relation meaning on their own.
+STOPWORDS = {
+    "در", "از", "با", "به", "برای", "را", "و", "که", "تا", "بر", "این", "آن", "ان", "یک",
+    "کرد", "کردند", "کرده", "شد", "شدند", "شده", "بود", "بودند", "است", "هست", "داد", "دادند",
+    "گرفت", "نمود", "داشت", "زد", "می", "نمی", "هم", "اش", "خود",
+}
+PREFIXES = ("نمی", "می", "ب")
+SUFFIXES = ("هایی", "های", "ها", "اند", "ند", "ید", "یم", "ه", "ی")
+
+
+def normalize(text: str) -> str:
+    """Folds letter/digit variants, drops diacritics and collapses whitespace."""
+    text = DIACRITICS.sub("", text.translate(CHARACTER_FOLDING))
+    return " ".join(text.split())
+
+
+def tokenize(text: str) -> list[str]:
+    return WORD.findall(normalize(text).lower())
+
+
+def stem(word: str) -> str:
+    """A deliberately light stemmer: strips one verbal prefix and one plural/verbal suffix."""
+    for prefix in PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= 3:
+            word = word[len(prefix):]
+            break
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def content_terms(text: str) -> set[str]:
+    """The set of stemmed, non-stopword terms of a text (underscores count as word breaks)."""
+    terms = set()
+    for word in tokenize(text.replace("_", " ")):
+        if word in STOPWORDS or len(word) < 2:
+            continue
+        terms.add(word)
+        terms.add(stem(word))
+    return terms
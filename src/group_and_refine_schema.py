@@ -3,9 +3,11 @@ import ijson
 import json
 from dotenv import load_dotenv
 import google.generativeai as genai
-import time
 from tqdm import tqdm
 
+# --- Sibling Import Fix ---
+from llm_client import generate_content, is_json_response
+
 # --- Configuration ---
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -41,16 +43,15 @@ def call_generative_model(prompt, model):
     current_prompt = prompt
     for i in range(max_retries):
         try:
-            response = model.generate_content(current_prompt)
+            # Throttling and quota backoff are handled by the shared rate limiter.
+            response = generate_content(model, current_prompt, validate=is_json_response)
             cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
             return json.loads(cleaned_response)
         except json.JSONDecodeError as e:
             tqdm.write(f"  - JSON Decode Error: {e}. Retrying with self-correction...")
             current_prompt = f"Your previous response was not valid JSON. Please fix it. ERROR: {e}\n\nFAULTY TEXT:\n{response.text}"
-            time.sleep(2)
         except Exception as e:
             tqdm.write(f"  - An unexpected API error occurred: {e}. Retrying...")
-            time.sleep(2)
     tqdm.write("  - FAILED to get valid JSON after multiple retries.")
     return None
 
@@ -74,7 +75,6 @@ def generate_draft_map(farsi_relations, model):
         batch_map = call_generative_model(prompt, model)
         if batch_map:
             draft_map.update(batch_map)
-        time.sleep(1)
         
     print(f"Stage 1 Complete. Draft map contains {len(draft_map)} entries.")
     return draft_map
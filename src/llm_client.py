@@ -0,0 +1,375 @@
+"""
+Shared access layer for every Gemini call in the project.
+
+All scripts send their prompts through `generate_content`, so the requests-per-minute
+and tokens-per-minute budgets are enforced in one place (and across threads), and
+quota errors are retried with jittered exponential backoff instead of failing the
+chunk or batch outright. Responses are also kept in a content-addressed on-disk
+cache, so re-running an identical prompt (a retried chunk, a restarted curation
+batch) is answered locally without spending quota.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+# --- Quota Configuration ---
+# Defaults are conservative; raise them in .env to match the project's actual quota.
+GEMINI_REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "60"))
+GEMINI_TOKENS_PER_MINUTE = int(os.getenv("GEMINI_TOKENS_PER_MINUTE", "1000000"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "6"))
+BASE_BACKOFF_SECONDS = 2.0
+MAX_BACKOFF_SECONDS = 60.0
+
+# After a quota error the limiter slows down to this fraction of its current rate,
+# then creeps back towards the configured ceiling with every successful call.
+THROTTLE_FACTOR = 0.7
+RECOVERY_STEP = 0.05
+MIN_RATE_SCALE = 0.1
+
+# --- Response Cache Configuration ---
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(os.path.dirname(__file__), '..', 'data', 'llm_cache'))
+# Least recently used entries are evicted once the cache grows beyond this size. 0 disables the cache.
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "512"))
+
+QUOTA_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests"}
+TRANSIENT_ERROR_NAMES = {"ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "GatewayTimeout"}
+
+
+# Rough characters-per-token ratios for offline estimates. Latin text (the schema part
+# of our prompts) packs about 4 characters per token; Persian script about 2.5.
+LATIN_CHARS_PER_TOKEN = 4.0
+OTHER_CHARS_PER_TOKEN = 2.5
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Fast, offline approximation of a prompt's token count. Good enough for rate limiting
+    and cost planning; actual billing figures come from `response.usage_metadata`.
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    other_chars = len(text) - ascii_chars
+    return max(1, round(ascii_chars / LATIN_CHARS_PER_TOKEN + other_chars / OTHER_CHARS_PER_TOKEN))
+
+
+def usage_token_counts(response) -> tuple[int, int]:
+    """Returns (prompt_tokens, output_tokens) from a response's usage metadata; (0, 0) if there is none (e.g. a cache hit)."""
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if not usage_metadata:
+        return 0, 0
+    return (getattr(usage_metadata, "prompt_token_count", 0) or 0,
+            getattr(usage_metadata, "candidates_token_count", 0) or 0)
+
+
+class TokenBucket:
+    """A continuously refilling bucket holding at most `capacity` units (one minute's budget)."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.available = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float, rate_scale: float) -> None:
+        elapsed = now - self.updated_at
+        self.available = min(self.capacity, self.available + elapsed * self.capacity / 60.0 * rate_scale)
+        self.updated_at = now
+
+    def seconds_until(self, amount: float, rate_scale: float) -> float:
+        """Time until `amount` units are available; amounts above capacity wait for a full bucket."""
+        missing = min(amount, self.capacity) - self.available
+        if missing <= 0:
+            return 0.0
+        return missing / (self.capacity / 60.0 * rate_scale)
+
+
+class RateLimiter:
+    """
+    Thread-safe requests-per-minute and tokens-per-minute limiter.
+
+    Callers block in `acquire` until both budgets allow the request. Quota errors
+    reported via `on_quota_error` pause every caller and lower the effective rate,
+    which then recovers gradually as calls succeed.
+    """
+
+    def __init__(self, requests_per_minute: int = GEMINI_REQUESTS_PER_MINUTE, tokens_per_minute: int = GEMINI_TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.rate_scale = 1.0
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, estimated_tokens: int) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.requests.refill(now, self.rate_scale)
+                self.tokens.refill(now, self.rate_scale)
+                wait_seconds = max(
+                    self.paused_until - now,
+                    self.requests.seconds_until(1, self.rate_scale),
+                    self.tokens.seconds_until(estimated_tokens, self.rate_scale),
+                )
+                if wait_seconds <= 0:
+                    self.requests.available -= 1
+                    self.tokens.available -= min(estimated_tokens, self.tokens.capacity)
+                    return
+            time.sleep(wait_seconds)
+
+    def on_success(self, estimated_tokens: int, actual_tokens: int | None = None) -> None:
+        with self.lock:
+            if actual_tokens:
+                # Charge (or refund) the difference between the estimate and the real usage.
+                self.tokens.available -= actual_tokens - min(estimated_tokens, self.tokens.capacity)
+            self.rate_scale = min(1.0, self.rate_scale + RECOVERY_STEP)
+
+    def on_quota_error(self, pause_seconds: float) -> None:
+        with self.lock:
+            self.rate_scale = max(MIN_RATE_SCALE, self.rate_scale * THROTTLE_FACTOR)
+            self.paused_until = max(self.paused_until, time.monotonic() + pause_seconds)
+
+
+class ResponseCache:
+    """
+    On-disk response cache keyed by sha256(model name, prompt).
+
+    Each entry is one small JSON file; a hit refreshes the file's mtime, so evicting
+    the oldest mtimes first gives least-recently-used eviction across runs.
+    """
+
+    def __init__(self, cache_dir: str = LLM_CACHE_DIR, max_bytes: int = LLM_CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.total_bytes = 0
+        self.entry_count = 0
+        if os.path.isdir(cache_dir):
+            for path, size, _ in self._iter_entries():
+                self.total_bytes += size
+                self.entry_count += 1
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _iter_entries(self):
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def get(self, key: str) -> dict | None:
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, json.JSONDecodeError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        # Write-then-rename so concurrent readers never see a half-written entry.
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        with self.lock:
+            # Overwriting an entry replaces its size rather than adding a new entry.
+            try:
+                self.total_bytes -= os.path.getsize(path)
+            except OSError:
+                self.entry_count += 1
+            os.replace(temp_path, path)
+            self.total_bytes += len(data)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def discard(self, key: str) -> None:
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self.lock:
+            self.total_bytes -= size
+            self.entry_count -= 1
+
+    def _evict(self) -> None:
+        """Deletes least recently used entries until the cache is back under 90% of its budget."""
+        target = self.max_bytes * 0.9
+        for path, size, _ in sorted(self._iter_entries(), key=lambda entry: entry[2]):
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+            self.entry_count -= 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "entries": self.entry_count,
+                "size_mb": self.total_bytes / (1024 * 1024),
+            }
+
+
+_default_limiter = None
+_default_cache = None
+_defaults_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Returns the process-wide limiter shared by all call sites."""
+    global _default_limiter
+    with _defaults_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter()
+        return _default_limiter
+
+
+def get_response_cache() -> ResponseCache | None:
+    """Returns the process-wide response cache, or None if caching is disabled."""
+    global _default_cache
+    if LLM_CACHE_MAX_MB <= 0:
+        return None
+    with _defaults_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
+
+
+def is_json_response(text: str) -> bool:
+    """Validator for callers that expect a (possibly ```json fenced) JSON object."""
+    try:
+        json.loads(text.strip().replace("```json", "").replace("```", ""))
+        return True
+    except json.JSONDecodeError:
+        return False
+
+
+def has_json_lists(text: str, *keys: str) -> bool:
+    """Whether the text is a (possibly ```json fenced) JSON object holding a list under each of `keys`."""
+    try:
+        data = json.loads(text.strip().replace("```json", "").replace("```", ""))
+    except json.JSONDecodeError:
+        return False
+    return isinstance(data, dict) and all(isinstance(data.get(key), list) for key in keys)
+
+
+def is_graph_response(text: str) -> bool:
+    """Validator for extraction responses: a JSON object with a "graph" list."""
+    return has_json_lists(text, "graph")
+
+
+def is_packed_graph_response(text: str) -> bool:
+    """Validator for packed extraction responses, which also list the "segments" they covered."""
+    return has_json_lists(text, "graph", "segments")
+
+
+def discard_cached_response(model, prompt: str) -> None:
+    """Drops the cached response to a prompt, for responses a caller rejected after parsing them."""
+    cache = get_response_cache()
+    if cache is not None:
+        cache.discard(ResponseCache.make_key(getattr(model, "model_name", None) or repr(model), prompt))
+
+
+def cached_response(entry: dict):
+    """
+    Rebuilds a response-like object from a cache entry. Nothing was billed for it,
+    so usage_metadata is None, just like a response without usage information.
+    """
+    return SimpleNamespace(text=entry["text"], usage_metadata=None, cached=True)
+
+
+def is_quota_error(error: Exception) -> bool:
+    if type(error).__name__ in QUOTA_ERROR_NAMES or getattr(error, "code", None) == 429:
+        return True
+    return "429" in str(error) or "quota" in str(error).lower()
+
+
+def is_transient_error(error: Exception) -> bool:
+    return type(error).__name__ in TRANSIENT_ERROR_NAMES or getattr(error, "code", None) in (500, 502, 503, 504)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with "equal jitter": half the delay is fixed, half is random."""
+    delay = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def generate_content(model, prompt: str, limiter: RateLimiter | None = None, max_retries: int = GEMINI_MAX_RETRIES, validate=None, use_cache: bool = True, **kwargs):
+    """
+    Cached, rate-limited replacement for `model.generate_content(prompt)`.
+    Quota and transient server errors are retried; any other error is raised immediately.
+
+    Only responses for which `validate(text)` is true (when given) are cached, so a
+    malformed answer is never replayed on retry. Calls with extra generation kwargs
+    (e.g. streaming) bypass the cache.
+    """
+    cache = get_response_cache() if use_cache and not kwargs else None
+    cache_key = None
+    if cache is not None:
+        cache_key = ResponseCache.make_key(getattr(model, "model_name", None) or repr(model), prompt)
+        entry = cache.get(cache_key)
+        if entry is not None:
+            if validate is None or validate(entry["text"]):
+                return cached_response(entry)
+            cache.discard(cache_key)
+
+    limiter = limiter or get_rate_limiter()
+    estimated_tokens = estimate_tokens(prompt)
+    attempt = 0
+    while True:
+        limiter.acquire(estimated_tokens)
+        try:
+            response = model.generate_content(prompt, **kwargs)
+        except Exception as e:
+            if attempt >= max_retries or not (is_quota_error(e) or is_transient_error(e)):
+                raise
+            delay = backoff_delay(attempt)
+            if is_quota_error(e):
+                limiter.on_quota_error(delay)
+            attempt += 1
+            time.sleep(delay)
+            continue
+
+        usage_metadata = getattr(response, "usage_metadata", None)
+        limiter.on_success(estimated_tokens, getattr(usage_metadata, "total_token_count", None))
+        if cache_key is not None:
+            try:
+                text = response.text
+            except ValueError:
+                # Blocked or empty candidates have no text; let the caller deal with it uncached.
+                return response
+            if validate is None or validate(text):
+                cache.put(cache_key, {
+                    "model": getattr(model, "model_name", None),
+                    "text": text,
+                    "prompt_tokens": getattr(usage_metadata, "prompt_token_count", 0),
+                    "output_tokens": getattr(usage_metadata, "candidates_token_count", 0),
+                })
+        return response
@@ -1,50 +1,296 @@
 import os
+import re
 import sys
 import json
+import time
+import queue
+import threading
+import heapq
+from array import array
 import ijson
 from neo4j import GraphDatabase
+from neo4j.exceptions import ConstraintError, CypherTypeError, ServiceUnavailable, SessionExpired
 from dotenv import load_dotenv
 from tqdm import tqdm
 
 # --- Sibling Import Fix ---
-from graph_schema import BASE_NODE_LABELS, EVENT_HIERARCHY, CONCEPT_HIERARCHY
+from graph_schema import BASE_NODE_LABELS
+from schema_registry import label_closure
+from dedup import relationship_key
+from farsi_text import normalize
+from validate_graph import SOURCE_PATH, CLEAN_PATH, is_clean_current, validate_file, print_report
 
 # --- Configuration ---
 load_dotenv()
 NEO4J_URI = os.getenv("NEO4J_URI")
 NEO4J_USER = os.getenv("NEO4J_USER")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
-JSON_FILE_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'extracted_graph.json')
+# Population reads the validated copy of extracted_graph.json (see validate_graph.py).
+JSON_FILE_PATH = CLEAN_PATH
+# Rows that still fail on their own after a failing batch is bisected are written here instead of aborting the load.
+DEAD_LETTER_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'populate_dead_letter.jsonl')
+# Initial batch sizes; the writer adapts them to the observed transaction latency.
+BATCH_SIZE = 500
+# Nodes carry no properties beyond their name, so they are created in larger batches.
+NODE_BATCH_SIZE = 5000
+# Relationship rows are buffered per type; all buffers are flushed once this many rows
+# are waiting, which bounds memory when there are many rare relationship types.
+MAX_BUFFERED_ROWS = 20000
+# Labels and relationship types are interpolated into Cypher, so only plain identifiers are allowed.
+CYPHER_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# Concurrent writer sessions; each owns a partition of the nodes.
+WRITER_COUNT = int(os.getenv("NEO4J_WRITERS", "4"))
+# Nodes with at least this many new relationships are hubs. Writing a relationship locks both
+# endpoints, so nodes are grouped into writer partitions along their relationships; hubs are
+# left out of the grouping (one would pull most of the graph into one partition), so their
+# locks are shared between writers and the occasional deadlock is retried by execute_write.
+HUB_MIN_DEGREE = int(os.getenv("NEO4J_HUB_MIN_DEGREE", "50"))
+# Batches waiting per writer; the JSON reader blocks when a writer falls this far behind.
+WRITER_QUEUE_DEPTH = 4
+MIN_BATCH_SIZE = 50
+MAX_BATCH_SIZE = 20000
+# Batches are grown while transactions commit well under this, and shrunk when they take longer.
+TARGET_TRANSACTION_SECONDS = 2.0
+# How long execute_write keeps retrying transient errors (deadlocks, leader switches) before giving up.
+MAX_TRANSACTION_RETRY_SECONDS = 30
+# The QA prompt looks up entry points with db.index.fulltext.queryNodes("node_names", ...).
+FULLTEXT_INDEX_NAME = "node_names"
+# Lucene's Persian analyzer folds Arabic/Persian letter variants and drops Persian stopwords.
+FULLTEXT_ANALYZER = "persian"
+# Relationship properties QA queries commonly filter on. Relationship indexes are per type,
+# so each (type, property) pair seen in the data gets its own range index.
+INDEXED_REL_PROPERTIES = ("year", "type")
+INDEX_WAIT_SECONDS = 600
+# Property keys holding a year; values such as "۱۳۵۷" or "سال 1357" are stored as integers.
+YEAR_KEYS = {"year", "start_year", "end_year"}
+YEAR_PATTERN = re.compile(r"\d{3,4}")
+NUMBER_PATTERN = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?")
+# Neo4j integers are 64-bit; longer digit strings are kept as strings.
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+# Nested maps with at most this many scalar values are expanded into prefixed properties.
+MAX_EXPANDED_KEYS = 8
 
 # --- Helper Functions ---
-def get_all_labels(primary_label: str) -> list[str]:
-    """Traverses the hierarchy dictionaries to find all parent labels."""
-    if not primary_label or not isinstance(primary_label, str):
-        return []
-    labels = [primary_label]
-    current_label = primary_label
-    full_hierarchy = {**EVENT_HIERARCHY, **CONCEPT_HIERARCHY}
-    while current_label in full_hierarchy:
-        parent_label = full_hierarchy[current_label]
-        labels.append(parent_label)
-        current_label = parent_label
-    return labels
-
-def flatten_properties(props):
-    """
-    Recursively flattens property values. Converts any dict or list
-    found as a value into a JSON string.
+def fits_int64(number) -> bool:
+    return INT64_MIN <= number <= INT64_MAX
+
+def to_number(value: str):
+    """
+    Parses a Latin- or Persian-digit number ("۱۲٬۵۰۰", "3.5"); None if the string is not just
+    a number, or is an integer too large for Neo4j.
+    """
+    text = normalize(value).replace("٬", "").replace("٫", ".")
+    if NUMBER_PATTERN.fullmatch(text):
+        if "." in text:
+            return float(text)
+        number = int(text)
+        return number if fits_int64(number) else None
+    return None
+
+def to_year(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) if fits_int64(value) else None
+    if isinstance(value, str):
+        years = YEAR_PATTERN.findall(normalize(value))
+        if years:
+            return int(years[0])
+    return None
+
+def normalize_scalar(value):
+    if isinstance(value, str):
+        number = to_number(value)
+        return value.strip() if number is None else number
+    if isinstance(value, int) and not isinstance(value, bool) and not fits_int64(value):
+        return str(value)
+    return value
+
+def add_property(props: dict, key: str, value):
+    if value is None:
+        return
+    if key.lower() in YEAR_KEYS or key.lower().endswith("_year"):
+        year = to_year(value)
+        if year is not None:
+            props[key] = year
+            if isinstance(value, str) and normalize(value) != str(year):
+                # Keep the original wording ("اواخر ۱۳۵۷", a full date) next to the integer year.
+                props[f"{key}_text"] = value
+            return
+    if isinstance(value, dict):
+        if len(value) <= MAX_EXPANDED_KEYS and not any(isinstance(v, (dict, list)) for v in value.values()):
+            for sub_key, sub_value in value.items():
+                add_property(props, f"{key}_{sub_key}", sub_value)
+            return
+    elif isinstance(value, list):
+        items = [normalize_scalar(v) for v in value if v is not None]
+        if not any(isinstance(v, (dict, list)) for v in items) and len({type(v) for v in items}) <= 1:
+            props[key] = items
+            return
+    else:
+        props[key] = normalize_scalar(value)
+        return
+    # Last resort for structures Neo4j cannot store as property values.
+    props[key] = json.dumps(value, ensure_ascii=False)
+
+def normalize_properties(props):
+    """
+    Converts extracted properties to native, indexable Neo4j types: years and numeric strings
+    (Latin or Persian digits) become numbers, small flat maps are expanded into prefixed
+    scalar properties ({"cause": {"type": ...}} -> cause_type), and homogeneous lists are kept
+    as lists. Only deeper or mixed structures are stored as JSON strings.
     """
     if not isinstance(props, dict):
         return props
-    
-    flat_props = {}
+    typed_props = {}
     for key, value in props.items():
-        if isinstance(value, (dict, list)):
-            flat_props[key] = json.dumps(value, ensure_ascii=False)
-        else:
-            flat_props[key] = value
-    return flat_props
+        add_property(typed_props, str(key), value)
+    return typed_props
+
+def parse_row(rel):
+    """Validates one extracted relationship and returns its write row, or None if it is malformed."""
+    required_keys = ['head', 'head_label', 'relation', 'tail', 'tail_label', 'properties']
+    if not isinstance(rel, dict) or not all(k in rel for k in required_keys):
+        return None
+
+    head_label = rel.get('head_label')
+    tail_label = rel.get('tail_label')
+    head_name = rel.get('head')
+    tail_name = rel.get('tail')
+    relation = rel.get('relation')
+
+    if not all([
+        isinstance(head_label, str) and head_label.strip(),
+        isinstance(tail_label, str) and tail_label.strip(),
+        isinstance(head_name, str) and head_name.strip(),
+        isinstance(tail_name, str) and tail_name.strip(),
+        isinstance(relation, str) and relation.strip()
+    ]):
+        return None
+
+    rel_props = normalize_properties(rel.get('properties', {})) # <-- TYPING STEP
+    if isinstance(rel_props, dict) and 'occurrences' in rel:
+        # Set by compaction: how many overlapping chunks extracted this same relationship.
+        rel_props = {**rel_props, 'occurrences': rel['occurrences']}
+    return {
+        "head_name": head_name,
+        "head_labels": label_closure(head_label),
+        "tail_name": tail_name,
+        "tail_labels": label_closure(tail_label),
+        "rel_type": relation.upper(),
+        "rel_props": rel_props,
+        # Identifies the source record, so later delta runs can tell what is already in the graph.
+        "record_key": relationship_key(rel),
+    }
+
+def iter_rows(desc: str):
+    """Streams the JSON file and yields a write row for every well-formed relationship (None for malformed ones)."""
+    with open(JSON_FILE_PATH, 'r', encoding='utf-8') as f:
+        # use_float: plain floats instead of Decimal, which the driver cannot send.
+        for rel in tqdm(ijson.items(f, 'graph.item', use_float=True), desc=desc):
+            yield parse_row(rel)
+
+def ensure_validated():
+    """
+    (Re)validates extracted_graph.json when its clean copy is missing, older, or was validated
+    against a different schema or curated map, so only valid rows are loaded.
+    """
+    if is_clean_current():
+        return
+    print(f"Validating {SOURCE_PATH} ...")
+    print_report(validate_file())
+
+def node_key(labels, name: str) -> tuple:
+    """
+    Nodes are identified by the root of their label hierarchy and their name, so an entity
+    extracted once as a Protest and once as a Conflict is one Event node carrying both labels,
+    and no two nodes can share a name under a constrained parent label.
+    """
+    return labels[-1], name
+
+def add_node(nodes: dict, labels: tuple, name: str):
+    """Records a node; labels seen for the same node in different rows are combined."""
+    key = node_key(labels, name)
+    known = nodes.get(key)
+    if known is None:
+        nodes[key] = labels
+    elif not set(labels) <= set(known):
+        nodes[key] = tuple(dict.fromkeys(labels[:-1] + known))
+
+def is_identifier(name: str) -> bool:
+    return bool(CYPHER_IDENTIFIER.match(name))
+
+def build_node_query(labels: tuple) -> str:
+    """
+    Native Cypher creating the nodes of one label set (the root label last).
+    MERGE on (:RootLabel {name}) uses the uniqueness constraint's index.
+    """
+    other_labels = "".join(f":`{label}`" for label in labels[:-1])
+    return f"""
+    UNWIND $batch AS name
+    MERGE (n:`{labels[-1]}` {{name: name}})
+    {f"SET n{other_labels}" if other_labels else ""}
+    RETURN name, elementId(n) AS id
+    """
+
+# Several source records can MERGE into the same relationship; it keeps the keys of all of them.
+RECORD_KEYS_UPDATE = """
+    SET r.record_keys = CASE WHEN row.record_key IN coalesce(r.record_keys, []) THEN r.record_keys
+                             ELSE coalesce(r.record_keys, []) + row.record_key END
+"""
+
+def build_relationship_query(rel_type: str) -> str:
+    """Native Cypher creating relationships of one type between nodes already looked up by id."""
+    return f"""
+    UNWIND $batch AS row
+    MATCH (head) WHERE elementId(head) = row.head_id
+    MATCH (tail) WHERE elementId(tail) = row.tail_id
+    MERGE (head)-[r:`{rel_type}`]->(tail)
+    ON CREATE SET r += row.rel_props
+    {RECORD_KEYS_UPDATE}
+    RETURN count(*) AS processed_count
+    """
+
+# Used only for labels and relationship types that cannot be written as Cypher identifiers.
+APOC_NODE_QUERY = """
+UNWIND $batch AS name
+CALL apoc.merge.node([last($labels)], {name: name}) YIELD node
+CALL apoc.create.addLabels(node, $labels) YIELD node AS labeled
+RETURN name, elementId(labeled) AS id
+"""
+
+APOC_RELATIONSHIP_QUERY = """
+UNWIND $batch AS row
+MATCH (head) WHERE elementId(head) = row.head_id
+MATCH (tail) WHERE elementId(tail) = row.tail_id
+CALL apoc.merge.relationship(head, row.rel_type, {}, row.rel_props, tail) YIELD rel
+WITH rel AS r, row
+""" + RECORD_KEYS_UPDATE + """
+RETURN count(*) AS processed_count
+"""
+
+EXISTING_RECORDS_QUERY = """
+MATCH ()-[r]->() WHERE r.record_keys IS NOT NULL
+UNWIND r.record_keys AS key
+RETURN key, elementId(r) AS id
+"""
+
+# Drops retracted record keys; relationships left without any source record are deleted,
+# and so are endpoints left without any relationship.
+RETRACT_QUERY = """
+UNWIND $batch AS row
+MATCH ()-[r]->() WHERE elementId(r) = row.id
+SET r.record_keys = [key IN r.record_keys WHERE NOT key IN row.keys]
+WITH r, startNode(r) AS head, endNode(r) AS tail
+WHERE size(r.record_keys) = 0
+DELETE r
+WITH [head, tail] AS ends
+UNWIND ends AS n
+WITH DISTINCT n
+WHERE NOT (n)--()
+DELETE n
+"""
 
 # --- Neo4j Operations ---
 def create_constraints(tx):
@@ -55,78 +301,428 @@ def create_constraints(tx):
         tx.run(query)
     print("Constraints checked.")
 
-def populate_graph():
-    """Streams the JSON file and populates the Neo4j database with the most robust query pattern."""
+def create_fulltext_index(tx):
+    """Full-text index over the name of every base label, used for the QA entry-point lookup."""
+    labels = "|".join(f"`{label}`" for label in BASE_NODE_LABELS)
+    tx.run(
+        f"CREATE FULLTEXT INDEX {FULLTEXT_INDEX_NAME} IF NOT EXISTS FOR (n:{labels}) ON EACH [n.name] "
+        f"OPTIONS {{indexConfig: {{`fulltext.analyzer`: '{FULLTEXT_ANALYZER}'}}}}"
+    )
+
+def create_relationship_indexes(tx, rel_properties):
+    """Range indexes for the given (relationship type, property) pairs."""
+    for rel_type, prop in sorted(rel_properties):
+        if is_identifier(rel_type):
+            tx.run(f"CREATE INDEX rel_{rel_type.lower()}_{prop} IF NOT EXISTS FOR ()-[r:`{rel_type}`]-() ON (r.`{prop}`)")
+
+def indexed_properties_in_graph(session) -> set:
+    """(relationship type, property) pairs present in the database that should be indexed."""
+    pairs = set()
+    for record in session.run("CALL db.schema.relTypeProperties() YIELD relType, propertyName"):
+        if record["propertyName"] in INDEXED_REL_PROPERTIES:
+            pairs.add((record["relType"].lstrip(":").strip("`"), record["propertyName"]))
+    return pairs
+
+def create_indexes(session, rel_properties):
+    """Creates the full-text and relationship indexes and waits until they are online."""
+    print("Ensuring indexes exist...")
+    session.execute_write(create_fulltext_index)
+    session.execute_write(create_relationship_indexes, rel_properties)
+    session.run("CALL db.awaitIndexes($timeout)", timeout=INDEX_WAIT_SECONDS).consume()
+    print("Indexes online.")
+
+def run_batch(tx, query: str, params: dict) -> list[dict]:
+    return [record.data() for record in tx.run(query, **params)]
+
+def is_memory_error(error: Exception) -> bool:
+    code = getattr(error, "code", None) or ""
+    return "OutOfMemory" in code or "MemoryPool" in code
+
+def is_row_error(error: Exception) -> bool:
+    """
+    Failures caused by the rows of a batch (a constraint or property type violation), or by
+    its size. Bisecting isolates these; any other error (syntax, missing procedure or index)
+    would fail for every row, so it stops the load instead.
+    """
+    return isinstance(error, (ConstraintError, CypherTypeError)) or is_memory_error(error)
+
+class AdaptiveBatchSize:
+    """Grows the batch size while transactions commit quickly; shrinks it when they are slow or run out of memory."""
+
+    def __init__(self, initial: int):
+        self.current = initial
+        self.lock = threading.Lock()
+
+    def observe(self, rows: int, seconds: float):
+        with self.lock:
+            if seconds > TARGET_TRANSACTION_SECONDS:
+                self.current = max(MIN_BATCH_SIZE, self.current // 2)
+            elif seconds < TARGET_TRANSACTION_SECONDS / 2 and rows >= self.current:
+                self.current = min(MAX_BATCH_SIZE, int(self.current * 1.5))
+
+    def shrink(self):
+        with self.lock:
+            self.current = max(MIN_BATCH_SIZE, self.current // 2)
+
+class PartitionedWriter:
+    """
+    Writes batches on several threads, each with its own session and bounded queue.
+    Batches are routed by partition; callers pick partitions so that concurrent writers
+    rarely lock the same nodes (see partition_nodes), and execute_write retries the
+    deadlocks that remain.
+    The caller keeps reading and batching while the writers run; it only blocks when a
+    writer's queue is full.
+
+    Each batch is written with execute_write, which retries transient errors. Submitted
+    batches are split to the current adaptive batch size. A batch that fails because of
+    its rows (see is_row_error) is bisected until the offending rows are isolated; those
+    go to the dead-letter file and the rest of the load continues. Any other error, such
+    as a query bug, a missing procedure or a lost connection, stops the run.
+    """
+
+    def __init__(self, driver, writer_count: int = WRITER_COUNT, dead_letter_path: str = DEAD_LETTER_PATH):
+        self.driver = driver
+        self.queues = [queue.Queue(maxsize=WRITER_QUEUE_DEPTH) for _ in range(writer_count)]
+        self.lock = threading.Lock()
+        self.batch_size = AdaptiveBatchSize(BATCH_SIZE)
+        self.rows_written = 0
+        self.dead_letter_path = dead_letter_path
+        self.dead_letter_count = 0
+        self.error = None
+        self.threads = [threading.Thread(target=self._run, args=(q,), daemon=True) for q in self.queues]
+        for thread in self.threads:
+            thread.start()
+
+    def start_phase(self, initial_batch_size: int):
+        """Resets the counters and batch size for a new kind of write; call only when no writes are pending."""
+        self.batch_size = AdaptiveBatchSize(initial_batch_size)
+        self.rows_written = 0
+
+    def partition_of(self, key) -> int:
+        return hash(key) % len(self.queues)
+
+    def submit(self, partition: int, query: str, rows: list, on_result=None, params: dict | None = None):
+        if self.error:
+            raise self.error
+        self.queues[partition].put((query, rows, on_result, params or {}))
+
+    def _run(self, batches: queue.Queue):
+        with self.driver.session(database="neo4j") as session:
+            while True:
+                item = batches.get()
+                try:
+                    if item is None:
+                        return
+                    if self.error:
+                        continue
+                    query, rows, on_result, params = item
+                    i = 0
+                    while i < len(rows):
+                        size = self.batch_size.current
+                        self._write(session, query, rows[i:i + size], on_result, params)
+                        i += size
+                except Exception as e:
+                    self.error = e
+                finally:
+                    batches.task_done()
+
+    def _write(self, session, query: str, rows: list, on_result, params: dict):
+        started = time.monotonic()
+        try:
+            records = session.execute_write(run_batch, query, {**params, "batch": rows})
+        except (ServiceUnavailable, SessionExpired):
+            raise
+        except Exception as e:
+            if not is_row_error(e):
+                raise
+            if is_memory_error(e):
+                self.batch_size.shrink()
+            if len(rows) == 1:
+                self.dead_letter(rows[0], f"{type(e).__name__}: {e}", params)
+                return
+            middle = len(rows) // 2
+            self._write(session, query, rows[:middle], on_result, params)
+            self._write(session, query, rows[middle:], on_result, params)
+            return
+        self.batch_size.observe(len(rows), time.monotonic() - started)
+        if on_result:
+            on_result(records)
+        with self.lock:
+            self.rows_written += len(rows)
+
+    def dead_letter(self, row, reason: str, params: dict | None = None):
+        entry = {"error": reason, "row": row, **(params or {})}
+        with self.lock:
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+            self.dead_letter_count += 1
+
+    def wait(self):
+        """Blocks until every submitted batch has been written."""
+        for batches in self.queues:
+            batches.join()
+        if self.error:
+            raise self.error
+
+    def close(self):
+        for batches in self.queues:
+            batches.put(None)
+        for thread in self.threads:
+            thread.join()
+
+def report_throughput(phase: str, rows: int, started: float):
+    elapsed = max(time.monotonic() - started, 1e-6)
+    print(f"{phase}: {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)")
+
+def create_nodes(writer: PartitionedWriter, nodes: dict) -> dict:
+    """
+    Phase 1: creates every distinct node once, grouped by label set, and returns the
+    map from node key to element id used to write relationships in phase 2.
+    """
+    by_labels = {}
+    for (root_label, name), labels in nodes.items():
+        by_labels.setdefault(labels, []).append(name)
+
+    node_ids = {}
+    writer.start_phase(NODE_BATCH_SIZE)
+    started = time.monotonic()
+    batch_number = 0
+    for labels, names in by_labels.items():
+        native = all(is_identifier(label) for label in labels)
+        query = build_node_query(labels) if native else APOC_NODE_QUERY
+
+        def store_ids(records, labels=labels):
+            for record in records:
+                node_ids[node_key(labels, record["name"])] = record["id"]
+
+        params = {} if native else {"labels": list(labels)}
+        batch_size = writer.batch_size.current
+        for i in range(0, len(names), batch_size):
+            # Distinct nodes never conflict, so node batches are simply spread over the writers.
+            writer.submit(batch_number % len(writer.queues), query, names[i:i + batch_size], store_ids, params)
+            batch_number += 1
+    writer.wait()
+    report_throughput("Nodes", len(node_ids), started)
+    return node_ids
+
+def partition_nodes(degrees: array, edges: array, partitions: int) -> array:
+    """
+    Assigns every node (by index) a writer partition, so that most relationships have both
+    endpoints in the same partition and concurrent writers do not wait on each other's locks.
+    Nodes joined by relationships between non-hubs are merged into groups (union-find), each
+    group limited to an even share of the relationships so that one large component cannot
+    serialize the load; the groups are then spread over the partitions, largest first.
+    Hubs belong to no group and get partition -1. Relationships touching a hub, or joining
+    two groups that hit the limit, may still contend.
+    """
+    parent = array('q', range(len(degrees)))
+    weight = array('q', [0]) * len(degrees)  # relationships inside each group
+    limit = max(1, len(edges) // 2 // partitions)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for j in range(0, len(edges), 2):
+        head, tail = edges[j], edges[j + 1]
+        if degrees[head] >= HUB_MIN_DEGREE or degrees[tail] >= HUB_MIN_DEGREE:
+            continue
+        head, tail = find(head), find(tail)
+        if head == tail:
+            weight[head] += 1
+        elif weight[head] + weight[tail] + 1 <= limit:
+            if weight[head] < weight[tail]:
+                head, tail = tail, head
+            parent[tail] = head
+            weight[head] += weight[tail] + 1
+
+    is_hub = [degree >= HUB_MIN_DEGREE for degree in degrees]
+    roots = {find(i) for i in range(len(degrees)) if not is_hub[i]}
+    roots = sorted(roots, key=lambda root: weight[root], reverse=True)
+    loads = [(0, partition) for partition in range(partitions)]
+    group_partition = {}
+    for root in roots:
+        load, partition = heapq.heappop(loads)
+        group_partition[root] = partition
+        heapq.heappush(loads, (load + max(weight[root], 1), partition))
+    return array('q', (-1 if is_hub[i] else group_partition[find(i)] for i in range(len(degrees))))
+
+def relationship_partition(writer: PartitionedWriter, node_partitions: array, head: int, tail: int) -> int:
+    """
+    A relationship goes to its head's partition, or to its tail's when the head is a hub.
+    Relationships between two hubs are spread over the writers.
+    """
+    for node in (head, tail):
+        if node_partitions[node] >= 0:
+            return node_partitions[node]
+    return head % len(writer.queues)
+
+def write_relationships(writer: PartitionedWriter, node_ids: dict, existing: dict, node_index: dict, node_partitions: array) -> tuple[int, int]:
+    """
+    Phase 2: streams the JSON again and writes relationships by node id, batched per
+    relationship type and partitioned by their endpoints' node groups (see partition_nodes).
+    Records already in the graph (`existing`) are skipped.
+    """
+    fallback_count = 0
+    missing_endpoint_count = 0
+    buckets = {}
+    buffered_rows = 0
+    query_cache = {}
+    writer.start_phase(BATCH_SIZE)
+    started = time.monotonic()
+
+    def flush(bucket):
+        nonlocal fallback_count
+        partition, rel_type = bucket
+        batch = buckets.pop(bucket)
+        if is_identifier(rel_type):
+            if rel_type not in query_cache:
+                query_cache[rel_type] = build_relationship_query(rel_type)
+            query = query_cache[rel_type]
+        else:
+            query = APOC_RELATIONSHIP_QUERY
+            fallback_count += len(batch)
+        writer.submit(partition, query, batch)
+
+    for row in iter_rows("Writing Relationships"):
+        if row is None or row["record_key"] in existing:
+            continue
+        head_key = node_key(row["head_labels"], row["head_name"])
+        tail_key = node_key(row["tail_labels"], row["tail_name"])
+        head_id = node_ids.get(head_key)
+        tail_id = node_ids.get(tail_key)
+        if head_id is None or tail_id is None:
+            # The endpoint's node batch was dead-lettered; the relationship cannot be written either.
+            writer.dead_letter({key: row[key] for key in ("head_name", "rel_type", "tail_name", "record_key")},
+                               "endpoint missing")
+            missing_endpoint_count += 1
+            continue
+        partition = relationship_partition(writer, node_partitions, node_index[head_key], node_index[tail_key])
+        bucket = (partition, row["rel_type"])
+        buckets.setdefault(bucket, []).append({
+            "head_id": head_id,
+            "tail_id": tail_id,
+            "rel_type": row["rel_type"],
+            "rel_props": row["rel_props"],
+            "record_key": row["record_key"],
+        })
+        buffered_rows += 1
+
+        if len(buckets[bucket]) >= writer.batch_size.current:
+            buffered_rows -= len(buckets[bucket])
+            flush(bucket)
+        elif buffered_rows >= MAX_BUFFERED_ROWS:
+            for pending in list(buckets):
+                flush(pending)
+            buffered_rows = 0
+
+    for pending in list(buckets):
+        flush(pending)
+    writer.wait()
+    report_throughput("Relationships", writer.rows_written, started)
+    if missing_endpoint_count:
+        print(f"Relationships skipped because an endpoint node was not created: {missing_endpoint_count}")
+    return writer.rows_written, fallback_count
+
+def fetch_existing_records(driver) -> dict:
+    """
+    Returns {record key: relationship element id} for every source record already in the graph.
+    This scans all relationships and holds every key in memory.
+    """
+    with driver.session(database="neo4j") as session:
+        return {record["key"]: record["id"] for record in session.run(EXISTING_RECORDS_QUERY)}
+
+def retract_records(writer: PartitionedWriter, existing: dict, current_keys: set) -> int:
+    """Removes records that are in the graph but no longer in the JSON; returns how many were retracted."""
+    stale = {}
+    for key, rel_id in existing.items():
+        if key not in current_keys:
+            stale.setdefault(rel_id, []).append(key)
+    rows = [{"id": rel_id, "keys": keys} for rel_id, keys in stale.items()]
+    writer.start_phase(BATCH_SIZE)
+    for i in range(0, len(rows), BATCH_SIZE):
+        batch = rows[i:i + BATCH_SIZE]
+        writer.submit(writer.partition_of(batch[0]["id"]), RETRACT_QUERY, batch)
+    writer.wait()
+    return sum(len(keys) for keys in stale.values())
+
+def populate_graph(delta: bool = True):
+    """
+    Populates the Neo4j database from the JSON file in two phases.
+    Phase 1 collects the distinct nodes and creates each one once, so hub entities are not
+    MERGEd again for every relationship they take part in. Phase 2 writes the relationships,
+    batched per type, by matching their endpoints on the ids returned by phase 1.
+    Both phases overlap reading the JSON with writing, on WRITER_COUNT concurrent sessions.
+
+    With `delta`, only records not yet in the graph are written, and records that were
+    removed from the JSON are retracted, so the database stays live and queryable. The
+    writes are proportional to the change, but finding it is not: every run still reads
+    all record keys from the graph (one relationship scan) and streams the whole JSON.
+    """
     print("Connecting to Neo4j database...")
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD),
+                                  max_transaction_retry_time=MAX_TRANSACTION_RETRY_SECONDS)
     driver.verify_connectivity()
     print("Connection successful.")
 
     with driver.session(database="neo4j") as session:
         session.execute_write(create_constraints)
 
-    cypher_query = """
-    UNWIND $batch as row
-    MERGE (head {name: row.head_name})
-    MERGE (tail {name: row.tail_name})
-    WITH head, tail, row
-    CALL apoc.create.addLabels(head, row.head_labels) YIELD node AS head_labeled
-    CALL apoc.create.addLabels(tail, row.tail_labels) YIELD node AS tail_labeled
-    CALL apoc.merge.relationship(head_labeled, row.rel_type, {}, row.rel_props, tail_labeled) YIELD rel
-    RETURN count(*) as processed_count
-    """
-
     processed_count = 0
     skipped_count = 0
-    batch = []
-    batch_size = 500
-
+    fallback_count = 0
+    retracted_count = 0
+    dead_letter_count = 0
     print(f"Starting to process {JSON_FILE_PATH}...")
     try:
-        with open(JSON_FILE_PATH, 'r', encoding='utf-8') as f:
-            relationships = ijson.items(f, 'graph.item')
-            
-            with driver.session(database="neo4j") as session:
-                for rel in tqdm(relationships, desc="Populating Graph"):
-                    required_keys = ['head', 'head_label', 'relation', 'tail', 'tail_label', 'properties']
-                    if not all(k in rel for k in required_keys):
-                        skipped_count += 1
-                        continue
-                    
-                    head_label = rel.get('head_label')
-                    tail_label = rel.get('tail_label')
-                    head_name = rel.get('head')
-                    tail_name = rel.get('tail')
-                    relation = rel.get('relation')
-
-                    if not all([
-                        isinstance(head_label, str) and head_label.strip(),
-                        isinstance(tail_label, str) and tail_label.strip(),
-                        isinstance(head_name, str) and head_name.strip(),
-                        isinstance(tail_name, str) and tail_name.strip(),
-                        isinstance(relation, str) and relation.strip()
-                    ]):
-                        skipped_count += 1
-                        continue
+        ensure_validated()
+        existing = fetch_existing_records(driver) if delta else {}
+        if delta:
+            print(f"Found {len(existing)} source records already in the graph.")
+        current_keys = set()
+        rel_properties = set()
+        nodes = {}
+        # Every new node gets an index; new relationships are kept as index pairs to group
+        # nodes into writer partitions, and counted per node to find the hubs.
+        node_index = {}
+        degrees = array('q')
+        edges = array('q')
+        for row in iter_rows("Collecting Nodes"):
+            if row is None:
+                skipped_count += 1
+                continue
+            current_keys.add(row["record_key"])
+            if isinstance(row["rel_props"], dict):
+                rel_properties.update((row["rel_type"], key) for key in INDEXED_REL_PROPERTIES if key in row["rel_props"])
+            if row["record_key"] in existing:
+                continue
+            add_node(nodes, row["head_labels"], row["head_name"])
+            add_node(nodes, row["tail_labels"], row["tail_name"])
+            for key in (node_key(row["head_labels"], row["head_name"]), node_key(row["tail_labels"], row["tail_name"])):
+                if key not in node_index:
+                    node_index[key] = len(degrees)
+                    degrees.append(0)
+                degrees[node_index[key]] += 1
+                edges.append(node_index[key])
+        hub_count = sum(1 for degree in degrees if degree >= HUB_MIN_DEGREE)
+        print(f"Found {len(nodes)} distinct nodes ({hub_count} hubs).")
 
-                    record_data = {
-                        "head_name": head_name,
-                        "head_labels": get_all_labels(head_label),
-                        "tail_name": tail_name,
-                        "tail_labels": get_all_labels(tail_label),
-                        "rel_type": relation.upper(),
-                        "rel_props": flatten_properties(rel.get('properties', {})) # <-- FLATTENING STEP
-                    }
-                    batch.append(record_data)
-
-                    if len(batch) >= batch_size:
-                        session.run(cypher_query, batch=batch)
-                        processed_count += len(batch)
-                        batch = []
-                
-                if batch:
-                    session.run(cypher_query, batch=batch)
-                    processed_count += len(batch)
+        writer = PartitionedWriter(driver)
+        try:
+            node_ids = create_nodes(writer, nodes)
+            node_partitions = partition_nodes(degrees, edges, len(writer.queues))
+            del edges
+            processed_count, fallback_count = write_relationships(writer, node_ids, existing, node_index, node_partitions)
+            if delta:
+                retracted_count = retract_records(writer, existing, current_keys)
+        finally:
+            writer.close()
+            dead_letter_count = writer.dead_letter_count
+
+        with driver.session(database="neo4j") as session:
+            create_indexes(session, rel_properties)
 
     except Exception as e:
         print(f"An error occurred during processing: {e}")
@@ -135,13 +731,29 @@ def populate_graph():
         print("Database connection closed.")
         print(f"\n--- Population Complete ---")
         print(f"Total relationships successfully processed: {processed_count}")
+        print(f"  of which written via the APOC fallback: {fallback_count}")
         print(f"Total malformed relationships skipped: {skipped_count}")
+        if delta:
+            print(f"Total source records retracted: {retracted_count}")
+        if dead_letter_count:
+            print(f"Total rows dead-lettered: {dead_letter_count} (see {DEAD_LETTER_PATH})")
 
 if __name__ == "__main__":
-    with GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD)) as driver:
-        with driver.session(database="neo4j") as session:
-            print("Clearing existing database for a clean run...")
-            session.run("MATCH (n) DETACH DELETE n")
-            print("Database cleared.")
+    if "--constraints-only" in sys.argv:
+        # After an offline import (src/bulk_import.py) only the constraints and indexes are missing.
+        with GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD)) as driver:
+            with driver.session(database="neo4j") as session:
+                session.execute_write(create_constraints)
+                create_indexes(session, indexed_properties_in_graph(session))
+        sys.exit(0)
+
+    # By default only the difference to the graph is written. --full wipes the database and reloads everything.
+    full_reload = "--full" in sys.argv
+    if full_reload:
+        with GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD)) as driver:
+            with driver.session(database="neo4j") as session:
+                print("Clearing existing database for a clean run...")
+                session.run("MATCH (n) DETACH DELETE n")
+                print("Database cleared.")
     
-    populate_graph()
\ No newline at end of file
+    populate_graph(delta=not full_reload)
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""
+Deterministic fast path for common question shapes.
+
+Questions like "who opposed X" or "چه کسی با X مخالفت کرد" map onto a handful of fixed
+Cypher shapes (the same ones the Text-to-Cypher prompt uses as examples). Each template
+here pairs English and Farsi patterns with a pre-planned, parameterized query, so those
+questions are answered without asking the model to write Cypher. Patterns are matched
+against the normalized question (see farsi_text.normalize), and the captured entity name
+is looked up through the node_names full-text index. Node names in the graph are Farsi, so
+a template is only used when the captured name is in Farsi script; an English question
+about "Bani Sadr" is left to the model, which translates the name.
+"""
+import re
+from dataclasses import dataclass
+
+from farsi_text import normalize
+from schema_registry import is_valid_relation
+
+# Lucene query syntax characters, escaped in names before the fuzzy full-text lookup.
+LUCENE_SPECIAL = re.compile(r'([+\-!(){}\[\]^"~*?:\\/]|&&|\|\|)')
+# Full-text matches considered as the question's entity, best score first.
+MAX_ENTITY_CANDIDATES = 3
+QUESTION_END = "؟?!. "
+LEADING_ARTICLE = re.compile(r"^the\s+", re.IGNORECASE)
+FARSI_SCRIPT = re.compile(r"[\u0600-\u06FF]")
+
+
+@dataclass
+class QuestionTemplate:
+    intent: str
+    patterns: list[re.Pattern]
+    relationship_types: list[str]
+    # Cypher after the entity lookup; `target` is the matched node and `{types}` the relationship types.
+    query: str
+
+    def cypher(self) -> str:
+        types = "|".join(f"`{t}`" for t in self.relationship_types)
+        return (
+            'CALL db.index.fulltext.queryNodes("node_names", $search) YIELD node AS target, score\n'
+            'WITH target ORDER BY score DESC LIMIT $candidates\n'
+            + self.query.format(types=types)
+        )
+
+
+def compile_patterns(*patterns: str) -> list[re.Pattern]:
+    return [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+
+
+TEMPLATES = [
+    QuestionTemplate(
+        "opposed",
+        compile_patterns(
+            r"^who (?:opposed|criticized|was against|were against) (?P<name>.+)$",
+            r"^چه کس(?:ی|انی) با (?P<name>.+?) مخالفت (?:کرد|کردند)$",
+            r"^مخالفان (?P<name>.+?)(?: چه کسانی بودند| کیان بودند| کی ها بودند)?$",
+        ),
+        ["OPPOSED", "CRITICIZED"],
+        "MATCH (person)-[r:{types}]->(target)\nRETURN DISTINCT person.name AS name, type(r) AS relation, target.name AS target",
+    ),
+    QuestionTemplate(
+        "supported",
+        compile_patterns(
+            r"^who (?:supported|backed) (?P<name>.+)$",
+            r"^چه کس(?:ی|انی) (?:از )?(?P<name>.+?) (?:را )?حمایت (?:کرد|کردند)$",
+            r"^حامیان (?P<name>.+?)(?: چه کسانی بودند| کیان بودند)?$",
+        ),
+        ["SUPPORTED"],
+        "MATCH (person)-[r:{types}]->(target)\nRETURN DISTINCT person.name AS name, type(r) AS relation, target.name AS target",
+    ),
+    QuestionTemplate(
+        "accused",
+        compile_patterns(
+            r"^why (?:was|were) (?P<name>.+?) accused(?: of .*)?$",
+            r"^who accused (?P<name>.+)$",
+            r"^چرا (?P<name>.+?) متهم (?:شد|شدند)$",
+            r"^چه کس(?:ی|انی) (?P<name>.+?) را متهم (?:کرد|کردند)$",
+        ),
+        ["ACCUSED", "WAS_ACCUSED", "WAS_ACCUSED_BY", "WAS_ACCUSED_IN", "WAS_ACCUSED_OF", "WERE_ACCUSED_IN"],
+        "MATCH (other)-[r:{types}]-(target)\nRETURN other.name AS other, type(r) AS relation, target.name AS target, r",
+    ),
+    QuestionTemplate(
+        "founded",
+        compile_patterns(
+            r"^what did (?P<name>.+?) found$",
+            r"^(?P<name>.+?) چه (?:چیزی|سازمانی|حزبی) (?:را )?(?:تاسیس|بنیان گذاری|بنیانگذاری) کرد$",
+        ),
+        ["FOUNDED"],
+        "MATCH (target)-[r:{types}]->(founded)\nRETURN DISTINCT founded.name AS founded, target.name AS founder",
+    ),
+    QuestionTemplate(
+        "members",
+        compile_patterns(
+            r"^who (?:was|were|is|are) (?:a )?members? of (?P<name>.+)$",
+            r"^چه کس(?:ی|انی) عضو (?P<name>.+?) (?:بود|بودند)$",
+            r"^اعضای (?P<name>.+?)(?: چه کسانی بودند| کیان بودند)?$",
+        ),
+        ["MEMBER_OF"],
+        "MATCH (member)-[r:{types}]->(target)\nRETURN DISTINCT member.name AS member, target.name AS organization",
+    ),
+]
+# Only relationship types that exist in the schema are queried; a template left with none is dropped.
+for template in TEMPLATES:
+    template.relationship_types = [t for t in template.relationship_types if is_valid_relation(t)]
+TEMPLATES = [template for template in TEMPLATES if template.relationship_types]
+
+
+def fulltext_search(name: str) -> str:
+    """Fuzzy full-text query for a name: every word escaped and matched fuzzily."""
+    escaped = (LUCENE_SPECIAL.sub(r"\\\1", word) for word in name.split())
+    return " ".join(f"{word}~" for word in escaped)
+
+
+def match_template(question: str):
+    """Returns (intent, cypher, params) for a question with a known shape, or None."""
+    text = normalize(question).strip(QUESTION_END)
+    for template in TEMPLATES:
+        for pattern in template.patterns:
+            match = pattern.match(text)
+            name = LEADING_ARTICLE.sub("", match.group("name").strip()) if match else ""
+            if FARSI_SCRIPT.search(name):
+                params = {"search": fulltext_search(name), "candidates": MAX_ENTITY_CANDIDATES}
+                return template.intent, template.cypher(), params
+    return None
@@ -3,9 +3,11 @@ import ijson
 import json
 from dotenv import load_dotenv
 import google.generativeai as genai
-import time
 from tqdm import tqdm
 
+# --- Sibling Import Fix ---
+from llm_client import generate_content, is_json_response
+
 # --- Configuration ---
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -60,7 +62,7 @@ def get_ai_standardization_for_batch(batch, model):
     max_retries = 3
     for i in range(max_retries):
         try:
-            response = model.generate_content(current_prompt)
+            response = generate_content(model, current_prompt, validate=is_json_response)
             cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
             return json.loads(cleaned_response)
         except json.JSONDecodeError as e:
@@ -80,10 +82,8 @@ def get_ai_standardization_for_batch(batch, model):
             
             Correct the faulty text and provide only the valid JSON object.
             """
-            time.sleep(2)
         except Exception as e:
             tqdm.write(f"  - An unexpected error occurred in batch processing: {e}. Retrying...")
-            time.sleep(2)
 
     tqdm.write(f"  - FAILED to process batch after {max_retries} retries.")
     return {} # Return empty dict on failure
@@ -108,7 +108,6 @@ def refine_schema_in_batches():
         batch_map = get_ai_standardization_for_batch(batch, model)
         final_schema_map.update(batch_map)
         tqdm.write(f"  - Received {len(batch_map)} mappings from batch. Total mappings so far: {len(final_schema_map)}")
-        time.sleep(1) # Rate limit to be safe
 
     print(f"\nCompleted all batches. Total unique mappings generated: {len(final_schema_map)}")
     
@@ -0,0 +1,150 @@
+"""
+Condenses Cypher query results into a small table for the answer-synthesis prompt.
+
+A broad question can match thousands of rows. Instead of materializing all of them and
+pasting them into the prompt as indented JSON, the QA flow caps the query with a LIMIT,
+streams at most that many records, flattens nodes and relationships into plain columns,
+merges duplicate rows, ranks what is left (rows seen more often, and relationships
+extracted from more passages, first), and keeps rows only while they fit a token budget.
+"""
+import json
+import os
+import re
+from collections import Counter
+
+from neo4j.graph import Node, Path, Relationship
+
+from llm_client import estimate_tokens
+
+QA_MAX_ROWS = int(os.getenv("QA_MAX_ROWS", "500"))
+QA_CONTEXT_TOKENS = int(os.getenv("QA_CONTEXT_TOKENS", "3000"))
+MAX_CELL_CHARS = 200
+TRAILING_LIMIT = re.compile(r"\bLIMIT\s+(\d+|\$\w+)\s*;?\s*$", re.IGNORECASE)
+
+
+def enforce_limit(cypher: str, max_rows: int = QA_MAX_ROWS) -> str:
+    """Adds a LIMIT to the query, or lowers an existing literal one that exceeds max_rows."""
+    cypher = cypher.strip().rstrip(";").strip()
+    match = TRAILING_LIMIT.search(cypher)
+    if match is None:
+        if re.search(r"\bUNION\b", cypher, re.IGNORECASE):
+            # A trailing LIMIT would only apply to the last branch; the streaming cap still bounds the rows.
+            return cypher
+        return f"{cypher}\nLIMIT {max_rows}"
+    if match.group(1).isdigit() and int(match.group(1)) > max_rows:
+        return cypher[:match.start()] + f"LIMIT {max_rows}"
+    return cypher
+
+
+def flatten_value(value):
+    """Turns driver graph types into plain dicts/lists of the properties worth showing."""
+    if isinstance(value, Node):
+        return {"name": value.get("name"), "labels": ":".join(sorted(value.labels))}
+    if isinstance(value, Relationship):
+        return {
+            "from": value.start_node.get("name") if value.start_node else None,
+            "type": value.type,
+            "to": value.end_node.get("name") if value.end_node else None,
+            **dict(value),
+        }
+    if isinstance(value, Path):
+        return [flatten_value(rel) for rel in value.relationships]
+    if isinstance(value, list):
+        # collect() of nodes or relationships
+        return [flatten_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: flatten_value(item) for key, item in value.items()}
+    return value
+
+
+def flatten_record(record) -> dict:
+    """One flat row per record: nested maps become `column.key` cells, lists are joined."""
+    row = {}
+    for key, value in record.items():
+        value = flatten_value(value)
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                row[f"{key}.{sub_key}"] = sub_value
+        else:
+            row[key] = value
+    return row
+
+
+def cell_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        text = "; ".join(cell_text(item) for item in value)
+    elif isinstance(value, dict):
+        text = json.dumps(value, ensure_ascii=False, default=str)
+    else:
+        text = str(value)
+    text = " ".join(text.split()).replace("|", "/")
+    return text if len(text) <= MAX_CELL_CHARS else text[:MAX_CELL_CHARS - 1] + "…"
+
+
+def row_weight(row: dict) -> int:
+    """How many source passages support a row, from the `occurrences` set at compaction."""
+    weight = 0
+    for key, value in row.items():
+        if key == "occurrences" or key.endswith(".occurrences"):
+            if isinstance(value, (int, float)):
+                weight += int(value)
+    return weight
+
+
+class ResultCondenser:
+    """
+    Accumulates streamed records into a ranked, deduplicated table that fits token_budget.
+    `add` returns False once max_rows records have been read, so callers can stop consuming.
+    """
+
+    def __init__(self, max_rows: int = QA_MAX_ROWS, token_budget: int = QA_CONTEXT_TOKENS):
+        self.max_rows = max_rows
+        self.token_budget = token_budget
+        self.counts = Counter()
+        self.rows = {}
+        self.read = 0
+        self.kept = 0
+
+    def add(self, record) -> bool:
+        if self.read >= self.max_rows:
+            return False
+        self.read += 1
+        flat = flatten_record(record)
+        row = {key: cell_text(value) for key, value in flat.items()}
+        identity = tuple(sorted(row.items()))
+        if identity not in self.rows:
+            self.rows[identity] = (row, row_weight(flat))
+        self.counts[identity] += 1
+        return self.read < self.max_rows
+
+    def table(self) -> str:
+        # Rows repeated in the result, and relationships extracted from more passages, come first.
+        ranked = sorted(self.rows, key=lambda identity: (self.counts[identity], self.rows[identity][1]), reverse=True)
+        columns = []
+        for identity in ranked:
+            for key, value in self.rows[identity][0].items():
+                if value and key not in columns:
+                    columns.append(key)
+        self.kept = 0
+        if not columns:
+            return ""
+
+        lines = [" | ".join(columns)]
+        used_tokens = estimate_tokens(lines[0])
+        for identity in ranked:
+            row = self.rows[identity][0]
+            line = " | ".join(row.get(column, "") for column in columns)
+            if self.counts[identity] > 1:
+                line += f" (x{self.counts[identity]})"
+            line_tokens = estimate_tokens(line)
+            if used_tokens + line_tokens > self.token_budget and self.kept:
+                break
+            lines.append(line)
+            used_tokens += line_tokens
+            self.kept += 1
+        if self.kept < len(ranked):
+            lines.append(f"... {len(ranked) - self.kept} more rows omitted")
+        return "\n".join(lines)
+
@@ -0,0 +1,323 @@
+"""
+Append-only checkpoint store for extraction results.
+
+Every finished chunk is written as one JSON line and fsync'd immediately, so a crash
+can lose at most the chunk that was in flight, and recording a batch never rewrites
+earlier results. Chunks are identified by the hash of their text, so an edited book
+only needs its changed chunks re-extracted, and results of removed chunks are retracted.
+`progress_stats.json` is derived from this log, and `compact` rebuilds the legacy
+`{"graph": [...]}` file that populate.py and the translation utility read.
+Relationships repeated across overlapping chunks are deduplicated as results arrive
+and written once, with an `occurrences` count, by `compact`.
+
+Usage (compaction only):
+    python src/results_store.py
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+from dedup import RelationshipDeduplicator, relationship_key
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+RESULTS_LOG_PATH = os.path.join(DATA_DIR, 'extraction_results.jsonl')
+GRAPH_OUTPUT_PATH = os.path.join(DATA_DIR, 'extracted_graph.json')
+STATS_PATH = os.path.join(DATA_DIR, 'progress_stats.json')
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+# One-off record holding everything extracted before the store existed.
+STATUS_LEGACY = "legacy"
+# Marks a chunk whose text no longer occurs in the book; its results are withdrawn.
+STATUS_RETRACTED = "retracted"
+# Tokens billed for a request that produced no chunk result (a packed request that could not be split).
+STATUS_USAGE = "usage"
+
+
+def iter_log_records(log_path: str):
+    """Yields (byte_offset, record) for every complete line of the log. Torn or corrupt lines are skipped."""
+    if not os.path.exists(log_path):
+        return
+    with open(log_path, 'rb') as f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            try:
+                yield offset, json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+
+
+def record_chunk_id(record: dict, chunk_hashes: list[str]) -> str | None:
+    """
+    The content hash identifying the chunk a record belongs to. Records written before
+    chunks were hashed only carry a position, which is resolved against the current book.
+    """
+    if record.get("chunk_hash"):
+        return record["chunk_hash"]
+    index = record.get("chunk")
+    if not isinstance(index, int):
+        return None
+    if 0 <= index < len(chunk_hashes):
+        return chunk_hashes[index]
+    return f"position:{index}"
+
+
+class ResultsStore:
+    """
+    Thread-safe, append-only JSONL log of per-chunk extraction results.
+
+    Results are keyed by the content hash of their chunk, not its position, so editing
+    the book (which shifts positions) only invalidates the chunks whose text changed.
+    Progress statistics are derived from the log once on open and then kept up to date in memory.
+    """
+
+    def __init__(self, log_path: str = RESULTS_LOG_PATH, chunk_hashes: list[str] | None = None):
+        self.log_path = log_path
+        self.chunk_hashes = list(chunk_hashes or [])
+        self.lock = threading.Lock()
+        self.chunk_status = {}  # chunk hash -> (status, relationship count)
+        self.chunk_keys = {}  # chunk hash -> dedup keys of its current relationships
+        self.deduplicator = RelationshipDeduplicator()
+        self.legacy_relationship_count = 0
+        self.total_input_tokens = 0
+        self.total_output_tokens = 0
+        self.last_updated = None
+        for _, record in iter_log_records(log_path):
+            self._apply(record)
+
+        os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+        needs_newline = os.path.exists(log_path) and os.path.getsize(log_path) > 0 and not self._ends_with_newline()
+        self.file = open(log_path, 'a', encoding='utf-8')
+        if needs_newline:
+            # A crash mid-write left a torn line; start the next record on a fresh line.
+            self.file.write("\n")
+            self.file.flush()
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.log_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _apply(self, record: dict) -> int:
+        """Folds one record into the in-memory view. Returns how many new unique relationships it added."""
+        status = record.get("status")
+        keys = [relationship_key(rel) for rel in record.get("relationships", [])]
+        self.total_input_tokens += record.get("input_tokens", 0)
+        self.total_output_tokens += record.get("output_tokens", 0)
+        self.last_updated = record.get("timestamp", self.last_updated)
+        if status == STATUS_USAGE:
+            return 0
+        if status == STATUS_LEGACY:
+            self.legacy_relationship_count += len(keys)
+            for chunk_hash in record.get("processed_chunk_hashes", []):
+                self.chunk_status[chunk_hash] = (STATUS_OK, 0)
+            for chunk_hash in record.get("failed_chunk_hashes", []):
+                self.chunk_status.setdefault(chunk_hash, (STATUS_FAILED, 0))
+            return self.deduplicator.add(keys)
+
+        chunk_id = record_chunk_id(record, self.chunk_hashes)
+        if chunk_id is None:
+            return 0
+        # A newer record for a chunk replaces the older one, including its dedup counts.
+        self.deduplicator.remove(self.chunk_keys.pop(chunk_id, []))
+        if status == STATUS_RETRACTED:
+            self.chunk_status.pop(chunk_id, None)
+        elif status in (STATUS_OK, STATUS_FAILED):
+            self.chunk_status[chunk_id] = (status, len(keys))
+            if status == STATUS_OK:
+                self.chunk_keys[chunk_id] = keys
+                return self.deduplicator.add(keys)
+        return 0
+
+    def _write(self, record: dict) -> int:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            return self._apply(record)
+
+    def append_chunk(self, chunk_index: int, relationships: list | None, input_tokens: int = 0, output_tokens: int = 0) -> int:
+        """
+        Durably records one chunk's result. `relationships` is None for a failed chunk.
+        Returns how many of the chunk's relationships were not already known from other chunks.
+        """
+        return self._write({
+            "chunk": chunk_index,
+            "chunk_hash": self.chunk_hashes[chunk_index] if chunk_index < len(self.chunk_hashes) else None,
+            "status": STATUS_FAILED if relationships is None else STATUS_OK,
+            "relationships": relationships or [],
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "timestamp": datetime.now().isoformat(),
+        })
+
+    def append_usage(self, input_tokens: int, output_tokens: int) -> None:
+        """Records tokens billed for a request whose output is not attributed to any chunk."""
+        self._write({
+            "chunk": None,
+            "status": STATUS_USAGE,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "timestamp": datetime.now().isoformat(),
+        })
+
+    def retract(self, chunk_hash: str) -> None:
+        """Withdraws the results of a chunk that no longer exists in the book."""
+        self._write({
+            "chunk": None,
+            "chunk_hash": chunk_hash,
+            "status": STATUS_RETRACTED,
+            "timestamp": datetime.now().isoformat(),
+        })
+
+    def diff(self) -> tuple[list[int], list[str]]:
+        """
+        Compares the log with the current book. Returns the positions of chunks that have
+        never been attempted (new or edited text) and the hashes of chunks with results
+        that no longer occur in the book.
+        """
+        with self.lock:
+            current = set(self.chunk_hashes)
+            new_positions = [i for i, chunk_hash in enumerate(self.chunk_hashes) if chunk_hash not in self.chunk_status]
+            stale_hashes = sorted(chunk_hash for chunk_hash in self.chunk_status if chunk_hash not in current)
+            return new_positions, stale_hashes
+
+    def import_legacy(self, graph_path: str, stats_path: str) -> int:
+        """One-time migration of an existing extracted_graph.json / progress_stats.json pair into the log."""
+        graph_data, stats = {}, {}
+        for path in (graph_path, stats_path):
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    if path == graph_path:
+                        graph_data = json.load(f)
+                    else:
+                        stats = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"WARNING: Could not read {path} for migration: {e}")
+        relationships = graph_data.get("graph", []) if isinstance(graph_data, dict) else []
+
+        def to_hashes(positions):
+            return [self.chunk_hashes[i] for i in positions if isinstance(i, int) and 0 <= i < len(self.chunk_hashes)]
+
+        self._write({
+            "chunk": None,
+            "status": STATUS_LEGACY,
+            "relationships": relationships,
+            "processed_chunk_hashes": to_hashes(stats.get("processed_chunks", [])),
+            "failed_chunk_hashes": to_hashes(stats.get("failed_chunks", [])),
+            "input_tokens": stats.get("total_input_tokens", 0),
+            "output_tokens": stats.get("total_output_tokens", 0),
+            "timestamp": stats.get("last_updated") or datetime.now().isoformat(),
+        })
+        return len(relationships)
+
+    def is_empty(self) -> bool:
+        return self.last_updated is None and not self.chunk_status
+
+    def derive_stats(self) -> dict:
+        """Builds the progress_stats.json view of the log for the current book."""
+        with self.lock:
+            processed, failed = [], []
+            for index, chunk_hash in enumerate(self.chunk_hashes):
+                status = self.chunk_status.get(chunk_hash, (None, 0))[0]
+                if status == STATUS_OK:
+                    processed.append(index)
+                elif status == STATUS_FAILED:
+                    failed.append(index)
+            current = set(self.chunk_hashes)
+            relationship_count = self.legacy_relationship_count + sum(
+                count for status, count in self.chunk_status.values() if status == STATUS_OK
+            )
+            return {
+                "total_chunks_in_book": len(self.chunk_hashes),
+                "processed_chunks": processed,
+                "failed_chunks": failed,
+                "stale_chunks": sum(1 for chunk_hash in self.chunk_status if chunk_hash not in current),
+                "total_relationships_extracted": relationship_count,
+                "unique_relationships": self.deduplicator.unique_count,
+                "duplicate_relationships": self.deduplicator.duplicate_count,
+                "total_input_tokens": self.total_input_tokens,
+                "total_output_tokens": self.total_output_tokens,
+                "last_updated": self.last_updated or "Never",
+            }
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def compact(log_path: str = RESULTS_LOG_PATH, output_path: str = GRAPH_OUTPUT_PATH, chunk_hashes: list[str] | None = None) -> int:
+    """
+    Writes the legacy {"graph": [...]} file from the log: legacy rows first, then the
+    latest successful result of every chunk in book order (retracted chunks are skipped).
+    Each distinct relationship is written once, at its first occurrence, with an
+    `occurrences` count. The output is streamed to a temporary file and swapped in
+    atomically, so the previous file survives a crash.
+    """
+    if not os.path.exists(log_path):
+        print(f"No results log found at {log_path}; nothing to compact.")
+        return 0
+
+    chunk_hashes = chunk_hashes or []
+    legacy_offsets = []
+    latest_records = {}  # chunk id -> (status, offset, position)
+    for offset, record in iter_log_records(log_path):
+        if record.get("status") == STATUS_LEGACY:
+            legacy_offsets.append(offset)
+            continue
+        chunk_id = record_chunk_id(record, chunk_hashes)
+        if chunk_id is not None:
+            latest_records[chunk_id] = (record.get("status"), offset, record.get("chunk"))
+
+    positions = {}
+    for index, chunk_hash in enumerate(chunk_hashes):
+        positions.setdefault(chunk_hash, index)
+    chunk_offsets = sorted(
+        (positions.get(chunk_id, float("inf")), offset)
+        for chunk_id, (status, offset, _) in latest_records.items() if status == STATUS_OK
+    )
+    offsets = legacy_offsets + [offset for _, offset in chunk_offsets]
+
+    def iter_selected_relationships(log):
+        for offset in offsets:
+            log.seek(offset)
+            yield from json.loads(log.readline()).get("relationships", [])
+
+    # First pass: occurrence counts per key (only hashes are held in memory).
+    deduplicator = RelationshipDeduplicator()
+    with open(log_path, 'rb') as log:
+        for rel in iter_selected_relationships(log):
+            deduplicator.add([relationship_key(rel)])
+
+    written = 0
+    written_keys = set()
+    temp_path = output_path + ".tmp"
+    with open(log_path, 'rb') as log, open(temp_path, 'w', encoding='utf-8') as out:
+        out.write('{\n  "graph": [')
+        for rel in iter_selected_relationships(log):
+            key = relationship_key(rel)
+            if key in written_keys:
+                continue
+            written_keys.add(key)
+            if isinstance(rel, dict):
+                rel = {**rel, "occurrences": deduplicator.counts[key]}
+            out.write(",\n    " if written else "\n    ")
+            out.write(json.dumps(rel, ensure_ascii=False))
+            written += 1
+        out.write("\n  ]\n}\n")
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temp_path, output_path)
+    return written
+
+
+if __name__ == "__main__":
+    print(f"Compacting {RESULTS_LOG_PATH} ...")
+    count = compact()
+    print(f"Wrote {count} relationships to {GRAPH_OUTPUT_PATH}")
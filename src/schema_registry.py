@@ -0,0 +1,57 @@
+"""
+Compiled, read-only view of src/graph_schema.py shared by extraction, population and QA.
+
+graph_schema.py stays the human-edited source of truth; this module compiles it once at
+import into the structures the pipeline queries per row: frozensets for validity checks,
+and the full label closure (a label plus all its hierarchy parents) for every known
+label. SCHEMA_VERSION is a hash of the schema content, so caches and derived artifacts
+can tell when the schema they were built against has changed.
+"""
+import hashlib
+import json
+
+from graph_schema import BASE_NODE_LABELS, EVENT_HIERARCHY, CONCEPT_HIERARCHY, RELATIONSHIP_TYPES
+
+# Child label -> parent label, across all hierarchies.
+PARENT_LABELS = {**EVENT_HIERARCHY, **CONCEPT_HIERARCHY}
+
+NODE_LABELS = frozenset(BASE_NODE_LABELS)
+# Labels that can appear on a node: the base labels plus hierarchy-only ones (e.g. Birth).
+ALL_LABELS = NODE_LABELS | frozenset(PARENT_LABELS) | frozenset(PARENT_LABELS.values())
+RELATION_TYPES = frozenset(RELATIONSHIP_TYPES)
+
+
+def compute_label_closure(label: str) -> tuple[str, ...]:
+    labels = [label]
+    while labels[-1] in PARENT_LABELS and PARENT_LABELS[labels[-1]] not in labels:
+        labels.append(PARENT_LABELS[labels[-1]])
+    return tuple(labels)
+
+
+# Label -> (label, parent, grandparent, ...), precomputed for every known label.
+LABEL_CLOSURE = {label: compute_label_closure(label) for label in ALL_LABELS}
+
+SCHEMA_VERSION = hashlib.sha256(json.dumps(
+    {"labels": BASE_NODE_LABELS, "hierarchy": PARENT_LABELS, "relationship_types": RELATIONSHIP_TYPES},
+    sort_keys=True,
+).encode("utf-8")).hexdigest()[:16]
+
+
+def label_closure(label: str) -> tuple[str, ...]:
+    """All labels a node with this primary label carries. Unknown labels have no parents."""
+    closure = LABEL_CLOSURE.get(label)
+    return closure if closure is not None else (label,)
+
+
+def is_valid_label(label) -> bool:
+    return isinstance(label, str) and label in ALL_LABELS
+
+
+def is_valid_relation(rel_type) -> bool:
+    return isinstance(rel_type, str) and rel_type in RELATION_TYPES
+
+
+def is_on_schema(rel) -> bool:
+    """Whether an extracted relationship uses only schema labels and relationship types."""
+    return isinstance(rel, dict) and is_valid_relation(rel.get("relation")) \
+        and is_valid_label(rel.get("head_label")) and is_valid_label(rel.get("tail_label"))
@@ -0,0 +1,167 @@
+"""
+Per-chunk selection of the relationship types to include in the extraction prompt.
+
+Embedding all of RELATIONSHIP_TYPES in every request makes the schema, not the book
+text, the bulk of each prompt. This module builds a local lexical index from the
+curated Farsi -> English schema map (the Farsi relation phrases each type was derived
+from), and for each chunk keeps only the types whose Farsi cue words occur in the text,
+plus a fixed set of always-on core types.
+
+The same index serves the QA interface: QuestionSchemaRetriever picks the labels and
+relationship types to show the Text-to-Cypher model for one question, combining the
+Farsi cues, the words of the English type names, and how often each type occurs in the graph.
+"""
+import json
+import os
+import re
+import threading
+from collections import Counter
+
+from graph_schema import BASE_NODE_LABELS, RELATIONSHIP_TYPES
+from farsi_text import content_terms
+from llm_client import estimate_tokens
+
+CURATED_MAP_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'curated_schema_map.json')
+
+# Broad relations that are plausible in almost any passage and are always offered.
+CORE_RELATIONSHIP_TYPES = [
+    "MEMBER_OF", "FOUNDED", "SUPPORTED", "OPPOSED", "CRITICIZED", "ACCUSED", "ARRESTED",
+    "APPOINTED", "LED", "HEADED", "PARTICIPATED_IN", "LOCATED_IN", "OCCURRED_IN", "OCCURRED_ON",
+    "MET_WITH", "SAID", "SPOKE_ABOUT", "WROTE", "PUBLISHED", "WORKED_FOR", "RELATED_TO",
+    "CHILD_OF", "MARRIED", "DIED_IN", "WAS_BORN_IN", "EXECUTED", "IMPRISONED", "SENTENCED",
+]
+# Upper bound on cue-selected types per chunk; the most strongly cued types win.
+MAX_SELECTED_TYPES = 120
+# Upper bound on question-cued types in a Text-to-Cypher prompt.
+MAX_QUESTION_TYPES = 60
+# The most frequent relationship types in the graph are always offered to the Cypher model,
+# so questions phrased without any cue word still see the relations most answers come from.
+FREQUENT_TYPES_ALWAYS_OFFERED = 30
+ENGLISH_WORD = re.compile(r"[a-z]+")
+ENGLISH_STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "at", "to", "for", "by", "with", "from", "as", "and", "or",
+    "is", "was", "were", "be", "been", "did", "do", "does", "who", "whom", "what", "which", "when",
+    "where", "why", "how", "has", "had", "have", "his", "her", "their", "it",
+}
+
+
+class SchemaSelector:
+    """Maps Farsi cue terms to candidate relationship types and selects a subset per chunk."""
+
+    def __init__(self, schema_map: dict[str, str], relationship_types: list[str] = RELATIONSHIP_TYPES,
+                 core_types: list[str] = CORE_RELATIONSHIP_TYPES, max_selected: int = MAX_SELECTED_TYPES):
+        valid_types = set(relationship_types)
+        self.all_types = list(relationship_types)
+        self.core_types = [t for t in core_types if t in valid_types]
+        self.max_selected = max_selected
+        self.cue_index: dict[str, set[str]] = {}
+        for farsi_term, english_type in schema_map.items():
+            if english_type not in valid_types:
+                continue
+            for term in content_terms(farsi_term):
+                self.cue_index.setdefault(term, set()).add(english_type)
+
+        # Per-type cost of its line in the prompt, for reporting savings without re-rendering prompts.
+        self.type_tokens = {t: estimate_tokens(f'    "{t}",\n') for t in self.all_types}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.tokens_saved = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.cue_index)
+
+    def select(self, chunk_text: str) -> list[str]:
+        """Returns the relationship types to offer for this chunk, in schema order."""
+        if not self.enabled:
+            return self.all_types
+        scores = Counter()
+        for term in content_terms(chunk_text):
+            for rel_type in self.cue_index.get(term, ()):
+                scores[rel_type] += 1
+        selected = set(self.core_types)
+        selected.update(rel_type for rel_type, _ in scores.most_common(self.max_selected))
+        return [t for t in self.all_types if t in selected]
+
+    def record(self, selected_types: list[str]) -> int:
+        """Tracks and returns the estimated prompt tokens saved by sending only `selected_types`."""
+        selected = set(selected_types)
+        saved = sum(cost for rel_type, cost in self.type_tokens.items() if rel_type not in selected)
+        with self.lock:
+            self.requests += 1
+            self.tokens_saved += saved
+        return saved
+
+
+def english_stem(word: str) -> str:
+    for suffix in ("ing", "ed", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def english_terms(text: str) -> set[str]:
+    return {english_stem(word) for word in ENGLISH_WORD.findall(text.lower().replace("_", " "))
+            if word not in ENGLISH_STOPWORDS}
+
+
+class QuestionSchemaRetriever:
+    """
+    Chooses the part of the schema a Text-to-Cypher prompt needs for one question.
+    `type_counts` and `label_counts` are the graph's relationship-type and label frequencies;
+    when known, types and labels absent from the graph are never offered.
+    """
+
+    def __init__(self, selector: SchemaSelector, type_counts: dict[str, int] | None = None,
+                 label_counts: dict[str, int] | None = None, max_types: int = MAX_QUESTION_TYPES):
+        self.selector = selector
+        self.type_counts = type_counts or {}
+        self.label_counts = label_counts or {}
+        self.max_types = max_types
+        self.english_index: dict[str, set[str]] = {}
+        for rel_type in selector.all_types:
+            for term in english_terms(rel_type):
+                self.english_index.setdefault(term, set()).add(rel_type)
+        ranked = sorted(self.type_counts, key=self.type_counts.get, reverse=True)
+        self.frequent_types = [t for t in ranked if t in selector.type_tokens][:FREQUENT_TYPES_ALWAYS_OFFERED]
+
+    def in_graph(self, rel_type: str) -> bool:
+        return not self.type_counts or self.type_counts.get(rel_type, 0) > 0
+
+    def select_types(self, question: str) -> list[str]:
+        """Returns the relationship types to offer for this question, in schema order."""
+        scores = Counter()
+        for term in content_terms(question):
+            for rel_type in self.selector.cue_index.get(term, ()):
+                scores[rel_type] += 1
+        for term in english_terms(question):
+            for rel_type in self.english_index.get(term, ()):
+                scores[rel_type] += 1
+        cued = sorted((t for t in scores if self.in_graph(t)),
+                      key=lambda t: (scores[t], self.type_counts.get(t, 0)), reverse=True)
+        selected = set(cued[:self.max_types])
+        selected.update(t for t in self.selector.core_types if self.in_graph(t))
+        selected.update(self.frequent_types)
+        return [t for t in self.selector.all_types if t in selected]
+
+    def select_labels(self) -> list[str]:
+        if not self.label_counts:
+            return list(BASE_NODE_LABELS)
+        return [label for label in BASE_NODE_LABELS if self.label_counts.get(label, 0) > 0]
+
+
+def load_schema_selector(map_path: str = CURATED_MAP_PATH) -> SchemaSelector:
+    """
+    Builds a selector from the curated schema map. Without the map there are no Farsi
+    cues, and the selector falls back to offering every relationship type.
+    """
+    schema_map = {}
+    if os.path.exists(map_path):
+        try:
+            with open(map_path, 'r', encoding='utf-8') as f:
+                schema_map = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"WARNING: Could not read {map_path}: {e}. Schema pruning disabled.")
+    else:
+        print(f"WARNING: {map_path} not found. Schema pruning disabled; every prompt carries the full schema.")
+    return SchemaSelector(schema_map)
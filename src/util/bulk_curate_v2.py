@@ -1,11 +1,15 @@
 import json
 import os
 import re
-import time
+import sys
 from dotenv import load_dotenv
 import google.generativeai as genai
 from tqdm import tqdm
 
+# --- Sibling Import Fix ---
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from llm_client import generate_content, is_json_response
+
 # --- Configuration ---
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -36,12 +40,12 @@ def call_generative_model(prompt, model):
     max_retries = 3
     for i in range(max_retries):
         try:
-            response = model.generate_content(prompt)
+            # Quota errors are already retried with backoff inside generate_content.
+            response = generate_content(model, prompt, validate=is_json_response)
             cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
             return json.loads(cleaned_response)
         except Exception as e:
             tqdm.write(f"  - API call attempt {i+1} failed. Error: {e}. Retrying...")
-            time.sleep(2)
     tqdm.write("  - FAILED to get valid JSON after multiple retries.")
     return None
 
@@ -104,7 +108,6 @@ def stage_two_ai_verb_generation(terms_to_fix, model):
         batch_map = call_generative_model(prompt, model)
         if batch_map:
             final_verbs_map.update(batch_map)
-        time.sleep(1) # Be a good citizen and rate-limit our calls
 
     if final_verbs_map:
         print(f"Stage 2 complete. Received {len(final_verbs_map)} verb suggestions from the AI.")
@@ -0,0 +1,220 @@
+"""
+Validation and repair pass between extraction and population.
+
+Streams an extracted {"graph": [...]} file, checks every row against the compiled schema
+(see schema_registry.py), repairs the common near-misses, and writes two streams:
+  - a clean {"graph": [...]} file that populate.py reads, containing only valid rows;
+  - a JSONL file of rejected rows, each with the reason it was rejected.
+
+Repairs:
+  - relation types differing only in case, spacing or separators ("member of" -> MEMBER_OF);
+  - Farsi relation strings found in the curated schema map;
+  - labels differing only in case or separators ("legal_case" -> LegalCase), including
+    hierarchy labels such as Birth that are not base labels;
+  - surrounding and repeated whitespace in names, and a missing properties object.
+
+The clean file is rebuilt when the source is newer, or when the schema or the curated map
+it was validated against has changed (recorded in a small metadata file next to it).
+
+Usage:
+    python src/validate_graph.py
+"""
+import hashlib
+import json
+import os
+import re
+from collections import Counter
+
+import ijson
+from tqdm import tqdm
+
+from farsi_text import normalize
+from schema_registry import ALL_LABELS, RELATION_TYPES, SCHEMA_VERSION, is_valid_label, is_valid_relation
+from schema_selector import CURATED_MAP_PATH
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+SOURCE_PATH = os.path.join(DATA_DIR, 'extracted_graph.json')
+CLEAN_PATH = os.path.join(DATA_DIR, 'extracted_graph.clean.json')
+REJECTS_PATH = os.path.join(DATA_DIR, 'extracted_graph.rejects.jsonl')
+# Schema version and curated map hash the clean file was validated against.
+CLEAN_META_PATH = os.path.join(DATA_DIR, 'extracted_graph.clean.meta.json')
+
+REQUIRED_KEYS = ('head', 'head_label', 'relation', 'tail', 'tail_label')
+SEPARATORS = re.compile(r"[\s\-_./]+")
+
+
+def label_key(label: str) -> str:
+    return SEPARATORS.sub("", label).lower()
+
+
+def relation_key(relation: str) -> str:
+    return SEPARATORS.sub("_", relation.strip()).strip("_").upper()
+
+
+def farsi_relation_key(relation: str) -> str:
+    return SEPARATORS.sub("_", normalize(relation)).strip("_")
+
+
+class GraphValidator:
+    """Checks and repairs extracted rows; counts rejects by reason and repairs by kind."""
+
+    def __init__(self, schema_map: dict[str, str] | None = None):
+        self.labels = {label_key(label): label for label in ALL_LABELS}
+        self.relations = {relation_key(rel_type): rel_type for rel_type in RELATION_TYPES}
+        self.farsi_relations = {
+            farsi_relation_key(farsi): english
+            for farsi, english in (schema_map or {}).items() if is_valid_relation(english)
+        }
+        self.rejects = Counter()
+        self.repairs = Counter()
+        self.valid_count = 0
+
+    def repair_label(self, label, repairs: list):
+        if is_valid_label(label):
+            return label
+        if isinstance(label, str) and label_key(label) in self.labels:
+            repairs.append("label_format")
+            return self.labels[label_key(label)]
+        return None
+
+    def repair_relation(self, relation, repairs: list):
+        if is_valid_relation(relation):
+            return relation
+        if not isinstance(relation, str) or not relation.strip():
+            return None
+        if relation_key(relation) in self.relations:
+            repairs.append("relation_format")
+            return self.relations[relation_key(relation)]
+        if farsi_relation_key(relation) in self.farsi_relations:
+            repairs.append("relation_farsi")
+            return self.farsi_relations[farsi_relation_key(relation)]
+        return None
+
+    def repair_name(self, name, repairs: list):
+        if isinstance(name, (int, float)) and not isinstance(name, bool):
+            name = str(name)
+        if not isinstance(name, str):
+            return None
+        cleaned = " ".join(name.split())
+        if cleaned != name:
+            repairs.append("name_whitespace")
+        return cleaned or None
+
+    def check(self, rel) -> tuple[dict | None, str | None]:
+        """Returns (repaired row, None) for a valid row, or (None, reason) for a rejected one."""
+        if not isinstance(rel, dict):
+            return None, "not_an_object"
+        if not all(key in rel for key in REQUIRED_KEYS):
+            return None, "missing_keys"
+
+        row = dict(rel)
+        # Repairs are only counted for rows that end up valid.
+        repairs = []
+        for key in ("head", "tail"):
+            row[key] = self.repair_name(rel[key], repairs)
+            if row[key] is None:
+                return None, f"bad_{key}_name"
+        for key in ("head_label", "tail_label"):
+            row[key] = self.repair_label(rel[key], repairs)
+            if row[key] is None:
+                return None, "unknown_label"
+        row["relation"] = self.repair_relation(rel["relation"], repairs)
+        if row["relation"] is None:
+            return None, "unknown_relation"
+
+        properties = rel.get("properties")
+        if properties is None:
+            repairs.append("properties_missing")
+            row["properties"] = {}
+        elif not isinstance(properties, dict):
+            return None, "bad_properties"
+        self.repairs.update(repairs)
+        return row, None
+
+
+def load_schema_map(map_path: str = CURATED_MAP_PATH) -> dict[str, str]:
+    if not os.path.exists(map_path):
+        print(f"WARNING: {map_path} not found. Farsi relation types will not be repaired.")
+        return {}
+    try:
+        with open(map_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, IOError) as e:
+        print(f"WARNING: Could not read {map_path}: {e}. Farsi relation types will not be repaired.")
+        return {}
+
+
+def validation_fingerprint(map_path: str = CURATED_MAP_PATH) -> dict:
+    """What validation depends on besides the source rows: the compiled schema and the curated map."""
+    map_hash = None
+    if os.path.exists(map_path):
+        with open(map_path, 'rb') as f:
+            map_hash = hashlib.sha256(f.read()).hexdigest()
+    return {"schema_version": SCHEMA_VERSION, "schema_map": map_hash}
+
+
+def is_clean_current(source_path: str = SOURCE_PATH, clean_path: str = CLEAN_PATH,
+                     meta_path: str = CLEAN_META_PATH) -> bool:
+    """True if the clean file exists, is not older than the source, and was validated against the current schema and map."""
+    if not os.path.exists(clean_path):
+        return False
+    if not os.path.exists(source_path):
+        # Nothing to rebuild it from.
+        return True
+    if os.path.getmtime(clean_path) < os.path.getmtime(source_path):
+        return False
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f) == validation_fingerprint()
+    except (json.JSONDecodeError, IOError):
+        return False
+
+
+def validate_file(source_path: str = SOURCE_PATH, clean_path: str = CLEAN_PATH,
+                  rejects_path: str = REJECTS_PATH, meta_path: str = CLEAN_META_PATH) -> GraphValidator:
+    """Streams source_path into the clean and reject files; both are replaced atomically."""
+    fingerprint = validation_fingerprint()
+    validator = GraphValidator(load_schema_map())
+    clean_temp, rejects_temp = clean_path + ".tmp", rejects_path + ".tmp"
+    with open(source_path, 'r', encoding='utf-8') as f, \
+            open(clean_temp, 'w', encoding='utf-8') as clean, \
+            open(rejects_temp, 'w', encoding='utf-8') as rejects:
+        clean.write('{\n  "graph": [')
+        for rel in tqdm(ijson.items(f, 'graph.item', use_float=True), desc="Validating"):
+            row, reason = validator.check(rel)
+            if reason:
+                validator.rejects[reason] += 1
+                rejects.write(json.dumps({"reason": reason, "row": rel}, ensure_ascii=False, default=str) + "\n")
+                continue
+            clean.write(",\n    " if validator.valid_count else "\n    ")
+            clean.write(json.dumps(row, ensure_ascii=False))
+            validator.valid_count += 1
+        clean.write("\n  ]\n}\n")
+        for out in (clean, rejects):
+            out.flush()
+            os.fsync(out.fileno())
+    os.replace(clean_temp, clean_path)
+    os.replace(rejects_temp, rejects_path)
+    # Written last, so an interrupted run leaves no metadata claiming the clean file is current.
+    with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(fingerprint, f)
+    os.replace(meta_path + ".tmp", meta_path)
+    return validator
+
+
+def print_report(validator: GraphValidator):
+    print(f"\n--- Validation Complete ---")
+    print(f"Valid relationships: {validator.valid_count}")
+    print(f"Rejected relationships: {sum(validator.rejects.values())}")
+    for reason, count in validator.rejects.most_common():
+        print(f"  {reason}: {count}")
+    print(f"Repairs applied: {sum(validator.repairs.values())}")
+    for kind, count in validator.repairs.most_common():
+        print(f"  {kind}: {count}")
+
+
+if __name__ == "__main__":
+    print(f"Validating {SOURCE_PATH} ...")
+    report = validate_file()
+    print_report(report)
+    print(f"Clean rows: {CLEAN_PATH}\nRejected rows: {REJECTS_PATH}")